@@ -45,6 +45,9 @@ setup(
     entry_points="""\
     [console_scripts]
     drop-all = gocept.testdb.cmdline:drop_all_entry_point
+    testdb-benchmark = gocept.testdb.benchmark:main
+    [pytest11]
+    gocept.testdb = gocept.testdb.pytest_plugin
     """,
     classifiers=[
         "Development Status :: 5 - Production/Stable",
@@ -1,7 +1,20 @@
+from . import script
+from .instrumentation import instrumented
+from .instrumentation import timing
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import CreateTable
+import asyncio
+import concurrent.futures
+import copy
+import functools
+import glob
+import hashlib
+import json
 import os
 import random
 import sqlalchemy
+import sqlalchemy.pool
+import threading
 import time
 
 
@@ -9,27 +22,107 @@ class Database:
 
     protocol = NotImplemented
     environ_prefix = NotImplemented
+    # Database to connect to for creating, dropping and listing databases:
+    maintenance_db = NotImplemented
+    maintenance_connect_args = {}
+    # Seconds for which a listing of the databases on the server is reused
+    # to check whether a database exists:
+    catalogue_ttl = 5
+    # Seconds to keep trying to drop a database and to wait after the first
+    # failed attempt:
+    drop_timeout = 10
+    drop_retry_delay = 0.05
+    # Dialect of SQL scripts for splitting them into statements:
+    script_dialect = NotImplemented
+    # Approximate number of characters of the schema sent to the server at
+    # once:
+    schema_batch_size = 1 << 20
+    # Lines of a schema file including another file, whose content is part
+    # of the digest. An optional `relative` group matches if the path is
+    # relative to the including file instead of the working directory:
+    include_pattern = None
 
     prefix = 'testdb'
+    db_template = None
+    force_template = False
 
-    def __init__(self, schema_path=None, prefix=None, db_name=None):
+    def __init__(self, schema_path=None, prefix=None, db_name=None,
+                 native=False, schema_progress=None, fast=False,
+                 drop_queue=None):
         self.schema_path = schema_path
+        self.native = native
+        # A `dropqueue.DropQueue` dropping the database in the background:
+        self.drop_queue = drop_queue
+        # Trade durability for speed, the data is thrown away anyway:
+        self.fast = fast
+        # Called with the number of bytes of the schema loaded so far and
+        # the size of the schema file:
+        self.schema_progress = schema_progress
+        # Engines by server and by DSN, shared with copies of this object:
+        self._maintenance_engines = {}
+        self._engines = {}
         if prefix is not None:
             self.prefix = prefix
         if db_name:
             self.db_name = db_name
         else:
-            self.db_name = '{}-{}'.format(
-                self.prefix, "%012x" % random.getrandbits(48))
-        self.db_host = (
-            os.environ.get('%s_HOST' % self.environ_prefix) or 'localhost')
-        self.db_port = os.environ.get('%s_PORT' % self.environ_prefix)
+            self.db_name = self._random_name()
+        self.servers = self._servers_from_environ()
+        self.db_host, self.db_port = self._place(self.db_name)
         self.db_user = os.environ.get('%s_USER' % self.environ_prefix)
         self.db_pass = os.environ.get('%s_PASS' % self.environ_prefix)
         self.cmd_postfix = os.environ.get(
             '%s_COMMAND_POSTFIX' % self.environ_prefix) or ''
         self.dsn = self.get_dsn(self.db_name)
 
+    def _servers_from_environ(self):
+        """Return the (host, port) pairs of the servers to use.
+
+        ``*_HOST`` and ``*_PORT`` may list several servers separated by
+        commas. A single host or port applies to all of them.
+
+        """
+        hosts = (os.environ.get('%s_HOST' % self.environ_prefix)
+                 or 'localhost').split(',')
+        ports = (os.environ.get('%s_PORT' % self.environ_prefix)
+                 or '').split(',')
+        if len(hosts) == 1:
+            hosts *= len(ports)
+        elif len(ports) == 1:
+            ports *= len(hosts)
+        if len(hosts) != len(ports):
+            raise ValueError(
+                '{0}_HOST and {0}_PORT list different numbers of'
+                ' servers.'.format(self.environ_prefix))
+        return [(host.strip() or 'localhost', port.strip() or None)
+                for host, port in zip(hosts, ports)]
+
+    def _place(self, db_name):
+        """Return the server a database of the given name is placed on.
+
+        The server is chosen by a hash of the name, so every process places
+        a database on the same server without having to agree on it.
+
+        """
+        if len(self.servers) == 1:
+            return self.servers[0]
+        digest = hashlib.sha256(db_name.encode('utf-8')).hexdigest()
+        return self.servers[int(digest[:8], 16) % len(self.servers)]
+
+    def _on_server(self, server):
+        """Return a copy of this database object talking to another server.
+        """
+        if server == (self.db_host, self.db_port):
+            return self
+        db = copy.copy(self)
+        db.db_host, db.db_port = server
+        db.dsn = db.get_dsn(db.db_name)
+        return db
+
+    def _on_servers(self):
+        """Return copies of this database object for each of the servers."""
+        return [self._on_server(server) for server in self.servers]
+
     def get_dsn(self, db_name):
         login = ''
         if self.db_user:
@@ -43,14 +136,60 @@ class Database:
         return '{proto}://{login}{host}/{name}'.format(
             proto=self.protocol, login=login, host=host, name=db_name)
 
+    def _random_name(self, server=None):
+        """Return a random name following the db naming scheme.
+
+        If ``server`` is given, the name places a database on that server.
+
+        """
+        while True:
+            name = '{}-{}'.format(
+                self.prefix, "%012x" % random.getrandbits(48))
+            if server is None or self._place(name) == server:
+                return name
+
+    def _copy(self, db_name, place=False):
+        """Return a copy of this database object for another database name.
+
+        The copy talks to the same server unless ``place`` is true, in which
+        case the database is placed on one of the servers by its name.
+
+        """
+        db = copy.copy(self)
+        db.db_name = db_name
+        if place:
+            db.db_host, db.db_port = self._place(db_name)
+        db.dsn = db.get_dsn(db_name)
+        return db
+
+    @instrumented('create', attr='db_name')
     def create(self):
         """Protocol entry point for setting up the database on the server.
 
-        Implementation may be optimised, for example for PostgreSQL to use
-        template databases.
+        If a template database is given, it is set up if necessary and the
+        database is cloned from it. Otherwise the schema is loaded into a new
+        database.
 
         """
-        self.create_db_from_schema(self.db_name)
+        if self.db_template:
+            self._setup_template()
+            self.create_from_template()
+        else:
+            self.create_db_from_schema(self.db_name)
+
+    @property
+    def template_source(self):
+        """Name of the database test databases are cloned from."""
+        return self.db_template
+
+    def create_from_template(self):
+        """Clone the database from the template, which has been set up."""
+        try:
+            self._copy_db(self.template_source, self.db_name)
+        except AssertionError as e:  # pragma: no cover
+            raise SystemExit(
+                "Could not create database %r from template %r: %s" %
+                (self.db_name, self.template_source, e))
 
     def create_db_from_schema(self, db_name):
         """Recipe for how to create a database from a schema.
@@ -62,13 +201,82 @@ class Database:
             self.create_db(db_name)
         except AssertionError as e:
             raise SystemExit(f"Could not create database {db_name!r}\n{e}")
-        if self.schema_path:
+        try:
+            self.create_schema(db_name)
+        except AssertionError:
+            raise SystemExit(
+                "Could not initialize schema in database %r." % db_name)
+
+    def setup_template(self):
+        """Create the template database or bring it up to date.
+
+        A template database that cannot be set up properly is removed.
+        Concurrent calls from several processes are serialised, so only the
+        first one builds the template and the others reuse it. If there are
+        several servers, the template is set up on each of them.
+
+        """
+        for db in self._on_servers():
+            db._setup_template()
+
+    @instrumented('setup_template', attr='db_template')
+    def _setup_template(self):
+        with self._template_lock():
             try:
-                self.create_schema(db_name)
-            except AssertionError:
-                raise SystemExit(
-                    "Could not initialize schema in database %r." % db_name)
-        self.mark_testing(db_name)
+                rebuilt = self.create_template()
+            except SystemExit as e:
+                try:
+                    self.drop_db(self.db_template)
+                except BaseException:  # pragma: no cover
+                    pass
+                raise e
+            self._template_set_up(rebuilt)
+
+    def _template_lock(self):
+        """Return a context manager holding a server-wide lock.
+
+        The lock is specific to the template name. Implementation depends on
+        the choice of database engine.
+
+        """
+        raise NotImplementedError
+
+    def create_template(self):
+        """Create the template database unless it is up to date.
+
+        If schema files have only been added since the template was built,
+        they are applied to a copy of it, which then replaces the template,
+        if the database engine supports that.
+
+        Returns whether the template database was (re-)built.
+
+        """
+        schema_digest = self._schema_digest()
+        # Another process may have built the template while we were waiting
+        # for the lock, so do not rely on a cached listing:
+        if self._db_exists(self.db_template, fresh=True):
+            template_digest = self._get_db_digest(self.db_template)
+            if not self.force_template and schema_digest == template_digest:
+                return False
+            if self.force_template or not self._update_template():
+                self.drop_db(self.db_template)
+                self.create_db_from_schema(self.db_template)
+        else:
+            self.create_db_from_schema(self.db_template)
+        return True
+
+    def _update_template(self):
+        """Apply schema files added since the template was built.
+
+        Returns whether that was possible. Depends on the choice of database
+        engine.
+
+        """
+        return False
+
+    def _template_set_up(self, rebuilt):
+        """Called after setting up the template, still holding the lock."""
+        pass
 
     def create_db(self, db_name):
         """Implementation of creating an empty database on the server.
@@ -79,56 +287,418 @@ class Database:
         """
         raise NotImplementedError
 
-    def create_schema(self, db_name):
+    def create_schema(self, db_name, paths=None):
         """Implementation of how to load a schema into an existing database.
 
-        Depends on the choice of database engine. Raises AssertionError if the
-        schema couldn't be loaded.
+        The statements returned by `_marker_sql` are to be executed in the
+        same batch, after the schema if there is one. If ``paths`` is given,
+        only those schema files are loaded into a database that has been
+        marked already and the marker is replaced. Depends on the choice of
+        database engine. Raises AssertionError if the schema couldn't be
+        loaded.
 
         """
         raise NotImplementedError
 
-    def create_engine(self, db_name=None):
+    def _schema_files(self):
+        """Return the paths of the schema files in the order to load them.
+
+        ``schema_path`` may name a file, a directory whose ``*.sql`` files
+        are loaded in the order of their names or be a list of file paths.
+
+        """
+        if self.schema_path is None:
+            return []
+        if isinstance(self.schema_path, (list, tuple)):
+            return list(self.schema_path)
+        if os.path.isdir(self.schema_path):
+            return sorted(glob.glob(os.path.join(self.schema_path, '*.sql')))
+        return [self.schema_path]
+
+    def _schema_batches(self, suffix='', paths=None):
+        """Yield the statements of the schema followed by ``suffix``.
+
+        The schema files are read while the statements are executed. They
+        are joined to batches of about ``schema_batch_size`` characters.
+        ``COPY ... FROM stdin`` statements are yielded as `script.Copy`.
+        ``paths`` defaults to all schema files. Raises AssertionError if a
+        file is not UTF-8 or contains psql meta-commands.
+
+        """
+        if paths is None:
+            paths = self._schema_files()
+        total = sum(os.path.getsize(path) for path in paths)
+        loaded = 0
+
+        def lines(f):
+            nonlocal loaded
+            for line in f:
+                loaded += len(line)
+                yield line.decode('utf-8')
+
+        def statements(path):
+            try:
+                with open(path, 'rb') as f:
+                    yield from script.split(lines(f), self.script_dialect)
+            except ValueError as e:
+                # Fail like a statement the server rejects.
+                raise AssertionError('{}: {}'.format(path, e))
+
+        for path in paths:
+            batch = []
+            size = 0
+            for statement in statements(path):
+                if isinstance(statement, script.Copy):
+                    if batch:
+                        yield ';\n'.join(batch)
+                        batch, size = [], 0
+                    yield statement
+                    self._report_progress(loaded, total)
+                    continue
+                batch.append(statement)
+                size += len(statement)
+                if size >= self.schema_batch_size:
+                    yield ';\n'.join(batch)
+                    batch, size = [], 0
+                    self._report_progress(loaded, total)
+            if batch:
+                yield ';\n'.join(batch)
+            self._report_progress(loaded, total)
+        if suffix:
+            yield suffix
+
+    def _write_schema(self, stream, suffix='', paths=None):
+        """Write the schema followed by ``suffix`` to a stream.
+
+        Stops early if the reading end is closed, e.g. because a client
+        program stopped at an error. ``paths`` defaults to all schema files.
+        The files are split while they are written, so a statement left
+        unterminated at the end of a file is terminated and a changed
+        ``DELIMITER`` is reset before the next file.
+
+        """
+        if paths is None:
+            paths = self._schema_files()
+        total = sum(os.path.getsize(path) for path in paths)
+        written = reported = 0
+        try:
+            for path in paths:
+                splitter = script.Splitter(self.script_dialect)
+                with open(path, 'rb') as f:
+                    for line in f:
+                        stream.write(line)
+                        # Only the state of the splitter is of interest.
+                        splitter.feed(line.decode('utf-8', 'replace'))
+                        written += len(line)
+                        if written - reported >= self.schema_batch_size:
+                            self._report_progress(written, total)
+                            reported = written
+                stream.write(self._end_of_file(splitter).encode('utf-8'))
+            self._report_progress(written, total)
+            stream.write(suffix.encode('utf-8'))
+            stream.close()
+        except BrokenPipeError:
+            pass
+
+    def _end_of_file(self, splitter):
+        """Return what ends the statements of a schema file."""
+        # in case the file does not end with a line break
+        end = '\n'
+        if splitter.finish() is not None:
+            end += splitter.delimiter + '\n'
+        if splitter.delimiter != ';':
+            end += 'DELIMITER ;\n'
+        return end
+
+    def _report_progress(self, loaded, total):
+        if self.schema_progress is not None:
+            self.schema_progress(loaded, total)
+
+    def create_engine(self, db_name=None, **kw):
+        """Return a new engine for the test database or another database.
+
+        Keyword arguments are passed to `sqlalchemy.create_engine`, e.g.
+        ``poolclass``. The caller is responsible for disposing the engine.
+
+        """
         if db_name is None:
             db_name = self.db_name
-        return sqlalchemy.create_engine(self.get_dsn(db_name))
+        return sqlalchemy.create_engine(self.get_dsn(db_name), **kw)
 
-    def mark_testing(self, db_name):
-        engine = self.create_engine(db_name)
-        meta = sqlalchemy.MetaData()
-        meta.bind = engine
-        table = sqlalchemy.Table(
-            'tmp_functest', meta,
-            sqlalchemy.Column('schema_mtime', sqlalchemy.Integer))
-        table.create(bind=engine)
-        engine.dispose()
+    def get_engine(self, db_name=None):
+        """Return an engine for the database that is kept for reuse.
 
-    @property
-    def is_testing(self):
-        engine = self.create_engine()
+        The engine does not keep connections open, which would prevent
+        other processes from dropping or cloning the database. It is discarded
+        by `dispose` and when the database is dropped.
+
+        """
+        if db_name is None:
+            db_name = self.db_name
+        dsn = self.get_dsn(db_name)
+        engine = self._engines.get(dsn)
+        if engine is None:
+            engine = self._engines.setdefault(dsn, self.create_engine(
+                db_name, poolclass=sqlalchemy.pool.NullPool))
+        return engine
+
+    def _dispose_engine(self, db_name):
+        """Close the connections kept open to a database."""
+        engine = self._engines.pop(self.get_dsn(db_name), None)
+        if engine is not None:
+            engine.dispose()
+
+    def maintenance_engine(self):
+        """Return the engine used for creating, dropping and listing databases.
+
+        It is created on first use and keeps one connection to the server
+        open for subsequent operations.
+
+        """
+        server = (self.db_host, self.db_port)
+        engine = self._maintenance_engines.get(server)
+        if engine is None:
+            engine = self._maintenance_engines.setdefault(
+                server, sqlalchemy.create_engine(
+                    self.get_dsn(self.maintenance_db),
+                    isolation_level='AUTOCOMMIT', pool_size=1,
+                    connect_args=self.maintenance_connect_args))
+        return engine
+
+    def _use_native(self):
+        """Whether to talk SQL to the server instead of calling client tools.
+
+        Falls back to the client tools if the database driver is missing.
+
+        """
+        if self.native:
+            try:
+                self.maintenance_engine()
+            except ImportError:  # pragma: no cover
+                self.native = False
+        return self.native
+
+    def _execute(self, statement, **params):
+        """Execute a statement on the maintenance connection.
+
+        Returns the result rows, if any. Raises AssertionError if the
+        statement fails.
+
+        """
+        try:
+            with self.maintenance_engine().connect() as conn:
+                result = conn.execute(sqlalchemy.text(statement), params)
+                if result.returns_rows:
+                    return result.fetchall()
+        except SQLAlchemyError as e:
+            raise AssertionError(str(e))
+
+    def _script_engine(self, db_name):
+        return self.create_engine(db_name)
+
+    def _execute_script(self, db_name, sql):
+        """Execute a string of SQL statements in the given database.
+
+        The statements are run in one transaction using the database driver.
+        Raises AssertionError if they fail.
+
+        """
+        self._execute_statements(db_name, [sql])
+
+    def _execute_statements(self, db_name, statements):
+        """Execute strings of SQL statements and `script.Copy` statements.
+
+        Like `_execute_script`, all of them are run in one transaction.
+
+        """
+        engine = self._script_engine(db_name)
         try:
+            conn = engine.raw_connection()
             try:
-                with engine.begin() as conn:
-                    conn.execute(sqlalchemy.text(
-                        'SELECT * from tmp_functest'
-                    ))
-                return True
-            except SQLAlchemyError:
-                return False
+                cursor = conn.cursor()
+                for statement in statements:
+                    if isinstance(statement, script.Copy):
+                        self._copy_from(cursor, statement)
+                    else:
+                        cursor.execute(statement)
+                        self._consume_results(cursor)
+                cursor.close()
+                conn.commit()
+            finally:
+                conn.close()
+        except (SQLAlchemyError, engine.dialect.dbapi.Error) as e:
+            raise AssertionError(str(e))
         finally:
             engine.dispose()
 
+    def _copy_from(self, cursor, copy):
+        """Load the data of a ``COPY ... FROM stdin`` statement.
+
+        Depends on the choice of database engine.
+
+        """
+        raise AssertionError(
+            'COPY FROM stdin is not supported by %s' % type(self).__name__)
+
+    def _consume_results(self, cursor):
+        """Fetch results of all statements executed by a script.
+
+        Needed by drivers that report errors of subsequent statements only
+        when their results are fetched.
+
+        """
+        pass
+
+    def dispose(self):
+        """Close the connections held by this object."""
+        for engines in (self._engines, self._maintenance_engines):
+            for key in list(engines):
+                engine = engines.pop(key, None)
+                if engine is not None:
+                    engine.dispose()
+
+    @instrumented('mark_testing', path='sql')
+    def mark_testing(self, db_name):
+        """Create the marker table in a database and record the schema.
+
+        Raises AssertionError if that fails.
+
+        """
+        self._execute_script(db_name, self._marker_sql(db_name))
+
+    def _marker_table(self):
+        return sqlalchemy.Table(
+            'tmp_functest', sqlalchemy.MetaData(),
+            sqlalchemy.Column('schema_mtime', sqlalchemy.Integer),
+            sqlalchemy.Column('schema_digest', sqlalchemy.String(64)),
+            sqlalchemy.Column('created', sqlalchemy.DateTime),
+            sqlalchemy.Column('pid', sqlalchemy.Integer),
+            sqlalchemy.Column('schema_files', sqlalchemy.Text))
+
+    def _marker_sql(self, db_name, replace=False):
+        """Return SQL creating the marker table and recording the schema.
+
+        The marker records the modification time and digest of the schema,
+        the name and digest of each schema file as JSON, when the database
+        was created and by which process. If ``replace`` is true, an existing
+        marker table is dropped first.
+
+        """
+        dialect = self.get_engine(db_name).dialect
+        table = self._marker_table()
+        file_digests = self._schema_file_digests()
+        insert = table.insert().values(
+            schema_mtime=self._schema_mtime(),
+            schema_digest=self._schema_digest(file_digests),
+            created=sqlalchemy.func.current_timestamp(),
+            pid=os.getpid(),
+            schema_files=json.dumps(file_digests))
+        drop = 'DROP TABLE IF EXISTS tmp_functest;\n' if replace else ''
+        return '{}{}{};\n{};\n'.format(
+            self._reset_session_sql(db_name), drop,
+            str(CreateTable(table).compile(dialect=dialect)).strip(),
+            insert.compile(
+                dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+    def _schema_mtime(self):
+        paths = self._schema_files()
+        if isinstance(self.schema_path, str) and os.path.isdir(
+                self.schema_path):
+            # Changes when files are added or removed
+            paths.append(self.schema_path)
+        return max((int(os.path.getmtime(path)) for path in paths), default=0)
+
+    def _schema_file_digests(self):
+        """Return a list of the name and content digest of each schema file.
+
+        The digest covers files included by the schema files, see
+        `file_digest`.
+
+        """
+        return [
+            [os.path.basename(path), file_digest(path, self.include_pattern)]
+            for path in self._schema_files()]
+
+    def _schema_digest(self, file_digests=None):
+        """Return a digest of the content of the schema files.
+
+        The digest of a single file is that of its content.
+
+        """
+        if file_digests is None:
+            file_digests = self._schema_file_digests()
+        if not file_digests:
+            return ''
+        if len(file_digests) == 1:
+            return file_digests[0][1]
+        return hashlib.sha256(''.join(
+            '{} {}\n'.format(name, digest)
+            for name, digest in file_digests).encode('utf-8')).hexdigest()
+
+    def _reset_session_sql(self, db_name):
+        """Return SQL undoing session settings a schema may have changed.
+
+        The marker table is created in the same session right after loading
+        the schema. Depends on the choice of database engine.
+
+        """
+        return ''
+
+    def get_marker(self, db_name=None):
+        """Return what the marker table of a database records as a dict.
+
+        Returns None if the database is not marked or the marker is empty.
+        Markers of earlier versions lack some of the keys.
+
+        """
+        try:
+            with self.get_engine(db_name).connect() as conn:
+                result = conn.execute(sqlalchemy.text(
+                    'SELECT * FROM tmp_functest'))
+                # Rows are mappings only as of SQLAlchemy 1.4.
+                keys = list(result.keys())
+                row = result.first()
+        except SQLAlchemyError:
+            return None
+        if row is None:
+            return None
+        return dict(zip(keys, row))
+
+    def _get_db_file_digests(self, db_name):
+        """Return the name and digest of each schema file loaded so far.
+
+        Returns an empty list if they were not recorded.
+
+        """
+        marker = self.get_marker(db_name) or {}
+        return json.loads(marker.get('schema_files') or '[]')
+
+    def _get_db_digest(self, db_name):
+        """Return the schema digest recorded in a database.
+
+        Returns None if the database has no digest recorded.
+
+        """
+        return (self.get_marker(db_name) or {}).get('schema_digest')
+
+    @property
+    def is_testing(self):
+        try:
+            with self.get_engine().begin() as conn:
+                conn.execute(sqlalchemy.text(
+                    'SELECT * from tmp_functest'
+                ))
+            return True
+        except SQLAlchemyError:
+            return False
+
     @property
     def exists(self):
-        engine = self.create_engine()
         try:
-            try:
-                with engine.connect():
-                    return True
-            except SQLAlchemyError:
-                return False
-        finally:
-            engine.dispose()
+            with self.get_engine().connect():
+                return True
+        except SQLAlchemyError:
+            return False
 
     def list_db_names(self):
         """Return a list of names of all databases that exist on the server.
@@ -138,33 +708,307 @@ class Database:
         """
         raise NotImplementedError
 
+    def _db_exists(self, db_name, fresh=False):
+        """Check whether a database exists on the server.
+
+        In native mode the server is asked about this one database. Otherwise
+        a listing of all databases is reused for ``catalogue_ttl`` seconds
+        unless ``fresh`` is true. Databases created and dropped through this
+        package are tracked in that listing, changes made by other processes
+        are only seen after it expired.
+
+        """
+        if self._use_native():
+            return self._db_exists_native(db_name)
+        names = catalogue.names(
+            self._catalogue_key(), 0 if fresh else self.catalogue_ttl,
+            self.list_db_names)
+        return db_name in names
+
+    def _db_exists_native(self, db_name):
+        """Implementation of checking for one database using SQL.
+
+        Depends on the choice of database engine.
+
+        """
+        raise NotImplementedError
+
+    def _catalogue_key(self):
+        return (self.protocol, self.db_host, self.db_port)
+
+    def _created(self, db_name):
+        """Record in the cached listing that a database was created."""
+        catalogue.add(self._catalogue_key(), db_name)
+
+    def _dropped(self, db_name):
+        """Record in the cached listing that a database was dropped."""
+        catalogue.discard(self._catalogue_key(), db_name)
+
+    @instrumented('snapshot', attr='db_name')
+    def snapshot(self, name):
+        """Save the current state of the test database under a name.
+
+        An existing snapshot of the same name is replaced. Connections to the
+        test database should be closed first.
+
+        """
+        snapshot_name = self._snapshot_name(name)
+        if self._db_exists(snapshot_name):
+            self.drop_db(snapshot_name)
+        try:
+            self._copy_db(self.db_name, snapshot_name)
+        except AssertionError as e:
+            raise RuntimeError(
+                f"Could not snapshot database {self.db_name!r} as {name!r}"
+                f"\n{e}")
+
+    @instrumented('restore', attr='db_name')
+    def restore(self, name):
+        """Return a database object for a new database copied from a snapshot.
+
+        The database is copied on the server of the snapshot, so it is given
+        a name that places it there.
+
+        """
+        db = self._copy(self._random_name(server=(self.db_host, self.db_port)))
+        try:
+            self._copy_db(self._snapshot_name(name), db.db_name)
+        except AssertionError as e:
+            raise RuntimeError(
+                f"Could not restore snapshot {name!r}\n{e}")
+        return db
+
+    def drop_snapshot(self, name):
+        self.drop_db(self._snapshot_name(name))
+
+    def _snapshot_name(self, name):
+        return f'{self.prefix}-snapshot-{name}'
+
+    def _copy_db(self, source, target):
+        """Implementation of copying a database on the server.
+
+        Depends on the choice of database engine. Raises AssertionError if the
+        database couldn't be copied.
+
+        """
+        raise NotImplementedError
+
     def drop(self):
         """Protocol entry point for tearing down the database on the server.
 
         Contains retry logic independent from the choice of database engine.
+        If there is a ``drop_queue``, the database is handed over to it to be
+        dropped in the background instead.
 
         """
-        for i in range(3):
-            if self.db_name not in self.list_db_names():
-                break
+        with timing(self, 'drop', self.db_name) as record:
+            for delay in self._drop_attempts(record):
+                # give the database some time to shut down
+                time.sleep(delay)
+
+    def _drop_attempts(self, record):
+        """Drop the database, yielding the delays to wait between attempts.
+
+        Shared by `drop` and `adrop`, which differ in how they wait.
+
+        """
+        if self.drop_queue is not None:
+            self.drop_queue.put(self)
+            return
+        delays = self._drop_retry_delays()
+        attempted = False
+        # Attempts are limited even if dropping fails without an error.
+        while self._db_exists(self.db_name):
+            if attempted:
+                delay = next(delays, None)
+                if delay is None:
+                    raise RuntimeError(
+                        "Could not drop database %r" % self.db_name)
+                record.retries += 1
+                yield delay
+            attempted = True
             try:
                 self.drop_db(self.db_name)
-            except AssertionError:  # pragma: no cover
-                # give the database some time to shut down
-                time.sleep(1)
-        else:  # pragma: no cover
-            raise RuntimeError("Could not drop database %r" % self.db_name)
+            except AssertionError:
+                # The cached listing may be out of date.
+                catalogue.invalidate(self._catalogue_key())
+
+    def _drop_retry_delays(self):
+        """Yield the delays between attempts to drop a database.
 
-    def drop_all(self):
+        They start at ``drop_retry_delay`` seconds and double up to a second
+        while attempts remain within ``drop_timeout`` seconds.
+
+        """
+        deadline = time.monotonic() + self.drop_timeout
+        delay = self.drop_retry_delay
+        while time.monotonic() + delay < deadline:
+            yield delay
+            delay = min(2 * delay, 1)
+
+    def _retire(self):
+        """Prepare the database for being dropped later.
+
+        Returns the name under which it is to be dropped. Implementation may
+        depend on the choice of database engine.
+
+        """
+        self._dispose_engine(self.db_name)
+        return self.db_name
+
+    @instrumented('drop_all')
+    def drop_all(self, drop_template=False, concurrency=1, min_age=None,
+                 progress=None):
         """Protocol entry point for dropping all test dbs on the server.
 
-        May need to be overridden in a given Database implementation, for
-        example to deal with PostgreSQL's template databases.
+        Template databases are only dropped if ``drop_template`` is true.
+        Up to ``concurrency`` databases are dropped at the same time. If
+        ``min_age`` is given, only databases created at least that many
+        seconds ago are dropped. ``progress`` is called with the name of each
+        database and whether it could be dropped. If there are several
+        servers, the databases on all of them are dropped.
+
+        Returns a `DropSummary`.
+
+        """
+        return self._drop_dbs(
+            self._dbs_to_drop(drop_template, min_age), concurrency, progress)
+
+    def drop_dbs(self, names, concurrency=1, progress=None):
+        """Drop the databases of the given names.
+
+        Each database is dropped on the server its name places it on.
+        ``concurrency`` and ``progress`` are used like by `drop_all`.
+
+        Returns a `DropSummary`.
+
+        """
+        return self._drop_dbs(
+            [(self._on_server(self._place(name)), name) for name in names],
+            concurrency, progress)
+
+    def _drop_dbs(self, targets, concurrency, progress):
+        summary = DropSummary()
+        start = time.monotonic()
+
+        def drop(target):
+            db, name = target
+            db._drop_recorded(name, summary, progress)
+
+        if concurrency > 1:
+            with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+                list(pool.map(drop, targets))
+        else:
+            for target in targets:
+                drop(target)
+        summary.duration = time.monotonic() - start
+        return summary
+
+    def _drop_recorded(self, db_name, summary, progress):
+        """Drop a database, recording in a `DropSummary` whether it worked.
+        """
+        try:
+            self.drop_db(db_name)
+        except AssertionError:
+            summary.failed.append(db_name)
+            success = False
+        else:
+            summary.dropped.append(db_name)
+            success = True
+        if progress is not None:
+            progress(db_name, success)
+
+    def _dbs_to_drop(self, drop_template=False, min_age=None):
+        """Return the databases to drop on all servers.
+
+        Returns pairs of a database object for the server and a name.
+
+        """
+        targets = []
+        for db in self._on_servers():
+            names = db._names_to_drop(drop_template)
+            if names and min_age is not None:
+                ages = db._db_ages()
+                names = [
+                    name for name in names if ages.get(name, -1) >= min_age]
+            targets.extend((db, name) for name in names)
+        return targets
+
+    def _names_to_drop(self, drop_template=False):
+        return [
+            name for name in self.list_db_names()
+            if (drop_template and self._matches_template_naming_scheme(name)
+                or self._matches_db_naming_scheme(name))]
+
+    def _db_ages(self):
+        """Return the age in seconds of the databases on the server by name.
+
+        Implementation depends on choice of database engine. Databases whose
+        age cannot be determined may be missing, so they are kept by
+        ``drop_all(min_age=...)``.
+
+        """
+        raise NotImplementedError
+
+    async def _run_in_executor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args))
+
+    async def acreate(self):
+        """Asynchronous version of `create`.
+
+        The blocking work is done in the event loop's default executor, so
+        several databases can be created concurrently.
+
+        """
+        await self._run_in_executor(self.create)
+
+    async def alist_db_names(self):
+        """Asynchronous version of `list_db_names`."""
+        return await self._run_in_executor(self.list_db_names)
+
+    async def adrop(self):
+        """Asynchronous version of `drop`.
+
+        Waits between retries without blocking the event loop.
 
         """
-        for name in self.list_db_names():
-            if self._matches_db_naming_scheme(name):
-                self.drop_db(name)
+        with timing(self, 'drop', self.db_name) as record:
+            attempts = self._drop_attempts(record)
+            while True:
+                delay = await self._run_in_executor(next, attempts, None)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+
+    async def adrop_all(self, drop_template=False, concurrency=None,
+                        min_age=None, progress=None):
+        """Asynchronous version of `drop_all` dropping concurrently.
+
+        ``concurrency`` limits the number of databases dropped at the same
+        time. Returns a `DropSummary`.
+
+        """
+        summary = DropSummary()
+        start = time.monotonic()
+        targets = await self._run_in_executor(
+            self._dbs_to_drop, drop_template, min_age)
+        semaphore = asyncio.Semaphore(concurrency or len(targets) or 1)
+
+        async def drop(db, name):
+            async with semaphore:
+                await self._run_in_executor(
+                    db._drop_recorded, name, summary, progress)
+
+        # Let all drops finish before raising unexpected errors.
+        results = await asyncio.gather(
+            *[drop(db, name) for db, name in targets],
+            return_exceptions=True)
+        summary.duration = time.monotonic() - start
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return summary
 
     def drop_db(self, db_name):
         """Implementation of dropping a database on the server.
@@ -175,6 +1019,14 @@ class Database:
         """
         raise NotImplementedError
 
+    def _matches_template_naming_scheme(self, name):
+        """Check whether name is a template database of this object.
+
+        Snapshots count as templates.
+
+        """
+        return name.startswith(self.prefix + '-snapshot-')
+
     def _matches_db_naming_scheme(self, name):
         """Check whether name fits the db naming scheme applied by __init__.
 
@@ -185,3 +1037,119 @@ class Database:
         if pieces[0] != self.prefix:
             return False
         return len(pieces[1]) == 12
+
+
+class DropSummary:
+    """Report on dropping a number of databases."""
+
+    def __init__(self):
+        self.dropped = []
+        self.failed = []
+        self.duration = 0.0
+
+    def __str__(self):
+        return 'Dropped %s database(s), %s failed, in %.1f seconds.' % (
+            len(self.dropped), len(self.failed), self.duration)
+
+
+class Catalogue:
+    """Names of the databases on each server as last listed.
+
+    Listings expire after a while because other processes may create and
+    drop databases on the same server.
+
+    """
+
+    def __init__(self):
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def names(self, key, ttl, list_db_names):
+        """Return the names of the databases on a server.
+
+        The server is listed by calling ``list_db_names`` unless it was listed
+        less than ``ttl`` seconds ago.
+
+        """
+        with self._lock:
+            listed, names = self._listings.get(key, (None, None))
+            if listed is None or time.monotonic() - listed >= ttl:
+                names = set(list_db_names())
+                self._listings[key] = (time.monotonic(), names)
+            return set(names)
+
+    def add(self, key, name):
+        with self._lock:
+            if key in self._listings:
+                self._listings[key][1].add(name)
+
+    def discard(self, key, name):
+        with self._lock:
+            if key in self._listings:
+                self._listings[key][1].discard(name)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._listings.pop(key, None)
+
+
+catalogue = Catalogue()
+
+
+def file_digest(path, include_pattern=None, _seen=()):
+    """Return the SHA-256 digest of a file's content.
+
+    If ``include_pattern`` is given, lines matching it name files whose
+    digests are added, recursively. Missing files and paths that are made up
+    of variables can only be represented by the name as written. A file is
+    read once per process as long as its size and modification time stay
+    the same.
+
+    """
+    digest, includes = _content_digest(path, include_pattern)
+    digest = digest.copy()
+    _seen += (os.path.abspath(path),)
+    for match in includes:
+        name = os.fsdecode(match.group('path').strip(b"'"))
+        if match.groupdict().get('relative'):
+            name = os.path.join(os.path.dirname(path), name)
+        if os.path.isfile(name) and os.path.abspath(name) not in _seen:
+            digest.update(
+                file_digest(name, include_pattern, _seen).encode('ascii'))
+        else:
+            digest.update(match.group(0))
+    return digest.hexdigest()
+
+
+# Digests of file contents by path and include pattern, along with the size
+# and modification time the file had when it was read:
+_content_digests = {}
+
+
+def _content_digest(path, include_pattern):
+    """Return the digest of a file's content and the include lines found.
+
+    The file is only read again if its size or modification time changed.
+    The digest is not to be updated by the caller.
+
+    """
+    key = (os.path.abspath(path), include_pattern)
+    stat = os.stat(path)
+    version = (stat.st_size, stat.st_mtime_ns)
+    cached = _content_digests.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1:]
+    digest = hashlib.sha256()
+    includes = []
+    with open(path, 'rb') as f:
+        if include_pattern is None:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+        else:
+            for line in f:
+                digest.update(line)
+                match = include_pattern.match(line)
+                if match is not None:
+                    includes.append(match)
+    _content_digests[key] = (version, digest, includes)
+    return digest, includes
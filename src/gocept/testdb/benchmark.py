@@ -0,0 +1,181 @@
+import argparse
+import gocept.testdb
+import json
+import os
+import os.path
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+
+BACKENDS = {
+    'postgresql': gocept.testdb.PostgreSQL,
+    'mysql': gocept.testdb.MySQL,
+}
+
+
+def percentile(values, fraction):
+    """Return the percentile of sorted values, interpolating linearly."""
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(durations):
+    """Return latency percentiles and throughput of a list of durations."""
+    values = sorted(durations)
+    total = sum(values)
+    return dict(
+        count=len(values),
+        min=values[0] if values else None,
+        max=values[-1] if values else None,
+        mean=total / len(values) if values else None,
+        p50=percentile(values, 0.5),
+        p90=percentile(values, 0.9),
+        p99=percentile(values, 0.99),
+        total=total,
+        throughput=len(values) / total if total else None,
+    )
+
+
+def summarize_total(count, total):
+    """Return the throughput of operations which were only timed together.
+    """
+    return dict(
+        count=count,
+        total=total,
+        throughput=count / total if total else None,
+    )
+
+
+def write_schema(path, tables):
+    with open(path, 'w') as f:
+        for i in range(tables):
+            f.write('CREATE TABLE table_%s '
+                    '(id int PRIMARY KEY, value text);\n' % i)
+
+
+def timed(func, *args, **kw):
+    start = time.monotonic()
+    func(*args, **kw)
+    return time.monotonic() - start
+
+
+class Benchmark:
+    """Measure the lifecycle operations of one database class."""
+
+    def __init__(self, backend, tables, iterations=10, template=False,
+                 native=False):
+        self.backend = backend
+        self.tables = tables
+        self.iterations = iterations
+        self.template = template
+        self.native = native
+        self.prefix = 'testdb-benchmark-PID%s' % os.getpid()
+
+    def make_database(self, **kw):
+        kw.setdefault('schema_path', self.schema_path)
+        kw.setdefault('prefix', self.prefix)
+        kw.setdefault('native', self.native)
+        if self.template:
+            kw.setdefault('db_template', self.prefix + '-template')
+        return BACKENDS[self.backend](**kw)
+
+    def result(self, operation, summary):
+        result = dict(
+            backend=self.backend,
+            operation=operation,
+            tables=self.tables,
+            template=self.template,
+            native=self.native,
+        )
+        result.update(summary)
+        return result
+
+    def run(self):
+        """Run all operations and return a list of results."""
+        tmpdir = tempfile.mkdtemp()
+        self.schema_path = os.path.join(tmpdir, 'schema.sql')
+        write_schema(self.schema_path, self.tables)
+        try:
+            return self._run()
+        finally:
+            self.make_database().drop_all(drop_template=True)
+            shutil.rmtree(tmpdir)
+
+    def _run(self):
+        results = []
+        if self.template:
+            durations = [
+                timed(self.make_database(force_template=True).setup_template)
+                for i in range(self.iterations)]
+            results.append(
+                self.result('create_template', summarize(durations)))
+
+        dbs = [self.make_database() for i in range(self.iterations)]
+        results.append(self.result(
+            'create', summarize([timed(db.create) for db in dbs])))
+        results.append(self.result(
+            'drop', summarize([timed(db.drop) for db in dbs])))
+
+        for db in dbs:
+            db.create()
+        # drop_all is one operation on all databases, so there are no
+        # durations of single databases to compute percentiles from.
+        duration = timed(self.make_database().drop_all)
+        results.append(self.result(
+            'drop_all', summarize_total(len(dbs), duration)))
+        return results
+
+
+def run(backends, sizes, iterations, native=False):
+    results = []
+    for backend in backends:
+        for tables in sizes:
+            for template in [False, True]:
+                results.extend(Benchmark(
+                    backend, tables, iterations, template, native).run())
+    return dict(
+        python=platform.python_version(),
+        timestamp=time.time(),
+        iterations=iterations,
+        results=results,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='testdb-benchmark',
+        description='Measure how long creating and dropping test databases '
+        'takes on the configured servers.')
+    parser.add_argument(
+        '-b', '--backend', action='append', choices=sorted(BACKENDS),
+        help='database server to measure, may be repeated (default: all)')
+    parser.add_argument(
+        '-t', '--tables', default='1,100,1000',
+        help='comma-separated numbers of tables in the schema '
+        '(default: %(default)s)')
+    parser.add_argument(
+        '-n', '--iterations', type=int, default=10,
+        help='number of times to run each operation (default: %(default)s)')
+    parser.add_argument(
+        '--native', action='store_true',
+        help='use SQL statements instead of the command-line clients')
+    parser.add_argument(
+        '-o', '--output', help='write results to this file (default: stdout)')
+    args = parser.parse_args(argv)
+    report = run(
+        args.backend or sorted(BACKENDS),
+        [int(size) for size in args.tables.split(',')],
+        args.iterations, args.native)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -1,37 +1,85 @@
+import argparse
 import gocept.testdb
 import sys
 
 
-def drop_mysql(name=None):
+def report(label, summary):
+    if summary is not None:
+        print(f'{label}: {summary}')
+
+
+def report_error(label, error):
+    print(f'{label}: could not drop databases: {error}', file=sys.stderr)
+
+
+def print_progress(name, success):
+    if success:
+        print(f'Dropped {name}')
+    else:
+        print(f'Could not drop {name}')
+
+
+def drop_mysql(name=None, templates=False, **kw):
     try:
         if name is None:
-            gocept.testdb.MySQL().drop_all()
+            return gocept.testdb.MySQL().drop_all(**kw)
         else:
-            gocept.testdb.MySQL(prefix=name).drop_all()
+            # Unlike on PostgreSQL, a database named exactly like the prefix
+            # is only dropped if asked to, as it was kept by earlier versions.
+            return gocept.testdb.MySQL(
+                prefix=name, db_template=name if templates else None
+            ).drop_all(drop_template=True, **kw)
     except OSError:  # pragma: no cover
         pass
+    except AssertionError as e:
+        report_error('MySQL', e)
 
 
-def drop_postgresql(name=None):
+def drop_postgresql(name=None, **kw):
     try:
         if name is None:
-            gocept.testdb.PostgreSQL().drop_all()
+            return gocept.testdb.PostgreSQL().drop_all(**kw)
         else:
-            gocept.testdb.PostgreSQL(
-                prefix=name, db_template=name).drop_all(drop_template=True)
+            return gocept.testdb.PostgreSQL(
+                prefix=name, db_template=name).drop_all(
+                    drop_template=True, **kw)
     except OSError:  # pragma: no cover
         pass
+    except AssertionError as e:
+        report_error('PostgreSQL', e)
 
 
-def drop_all(names):
-    if names:
-        for name in names:
-            drop_mysql(name)
-            drop_postgresql(name)
-    else:
-        drop_mysql()
-        drop_postgresql()
+def drop_all(names, concurrency=1, min_age=None, verbose=False,
+             mysql_templates=False):
+    kw = dict(concurrency=concurrency, min_age=min_age)
+    if verbose:
+        kw['progress'] = print_progress
+    for name in names or [None]:
+        report('MySQL', drop_mysql(name, mysql_templates, **kw))
+        report('PostgreSQL', drop_postgresql(name, **kw))
 
 
 def drop_all_entry_point():
-    drop_all(sys.argv[1:])
+    parser = argparse.ArgumentParser(
+        prog='drop-all',
+        description='Drop test databases from the MySQL and PostgreSQL '
+        'servers.')
+    parser.add_argument(
+        'names', nargs='*', metavar='prefix',
+        help='prefix of the test databases to drop')
+    parser.add_argument(
+        '-j', '--concurrency', type=int, default=1,
+        help='number of databases to drop at the same time')
+    parser.add_argument(
+        '--min-age', type=float, metavar='SECONDS',
+        help='only drop databases created at least this long ago')
+    parser.add_argument(
+        '-v', '--verbose', action='store_true',
+        help='report each database dropped')
+    parser.add_argument(
+        '--mysql-templates', action='store_true',
+        help='also drop MySQL databases named exactly like a prefix, which'
+        ' are template databases')
+    args = parser.parse_args(sys.argv[1:])
+    drop_all(args.names, args.concurrency, args.min_age, args.verbose,
+             args.mysql_templates)
@@ -0,0 +1,104 @@
+import atexit
+import collections
+import concurrent.futures
+import threading
+import warnings
+
+
+class DropQueue:
+    """Drop databases in a background thread instead of waiting for it.
+
+    Database objects created with ``drop_queue`` set to a `DropQueue` hand
+    their database over to it when `drop` is called. PostgreSQL renames the
+    database to a name following the naming scheme of the database object
+    first, which is quick and frees the original name at once. MySQL cannot
+    rename databases, so they keep their names. A background thread drops
+    the queued databases in batches of up to ``batch_size``, ``concurrency``
+    at a time.
+
+    Databases still queued when the process exits are dropped then. If the
+    process dies before, they are left for ``drop_all`` and the ``drop-all``
+    script to collect. Databases that cannot be dropped are listed in
+    ``failed`` and reported as a `RuntimeWarning`.
+
+    """
+
+    def __init__(self, batch_size=10, concurrency=4):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.dropped = []
+        self.failed = []
+        self._pending = collections.deque()
+        self._busy = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = None
+        atexit.register(self.close)
+
+    def put(self, db):
+        """Queue the database of a database object for dropping."""
+        if self._closed:
+            raise RuntimeError('The drop queue has been closed.')
+        name = db._retire()
+        db = db._copy(name)
+        db.drop_queue = None
+        with self._condition:
+            self._pending.append(db)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='gocept.testdb.dropqueue',
+                    daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def flush(self):
+        """Wait until all databases queued so far have been dropped."""
+        with self._condition:
+            while self._pending or self._busy:
+                self._condition.wait()
+
+    def close(self):
+        """Drop the databases still queued and stop the background thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        atexit.unregister(self.close)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not (self._pending or self._closed):
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batch = [
+                    self._pending.popleft()
+                    for i in range(min(self.batch_size, len(self._pending)))]
+                self._busy = True
+            try:
+                if len(batch) > 1 and self.concurrency > 1:
+                    with concurrent.futures.ThreadPoolExecutor(
+                            self.concurrency) as pool:
+                        list(pool.map(self._drop, batch))
+                else:
+                    for db in batch:
+                        self._drop(db)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def _drop(self, db):
+        try:
+            db.drop()
+        except Exception as e:
+            # The background thread has no caller to raise to.
+            warnings.warn(
+                'Could not drop database {!r}: {}'.format(db.db_name, e),
+                RuntimeWarning)
+            self.failed.append(db.db_name)
+        else:
+            self.dropped.append(db.db_name)
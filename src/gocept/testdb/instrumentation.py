@@ -0,0 +1,126 @@
+import atexit
+import collections
+import contextlib
+import functools
+import sys
+import threading
+import time
+
+
+Event = collections.namedtuple(
+    'Event', ['operation', 'db_name', 'duration', 'path', 'retries'])
+Event.__doc__ = """Timing of one operation on a database server.
+
+``path`` is ``'subprocess'`` if the operation used the command-line clients
+and ``'sql'`` if it talked to the server through the database driver.
+``retries`` counts repeated attempts, e.g. when dropping a database.
+"""
+
+_listeners = []
+
+
+def subscribe(listener):
+    """Register a callable to be called with each `Event`."""
+    _listeners.append(listener)
+
+
+def unsubscribe(listener):
+    _listeners.remove(listener)
+
+
+def notify(event):
+    for listener in list(_listeners):
+        listener(event)
+
+
+class Timing:
+    """Record of an operation in progress."""
+
+    def __init__(self):
+        self.retries = 0
+
+
+@contextlib.contextmanager
+def timing(database, operation, db_name=None, path=None):
+    """Time the enclosed code and notify the listeners afterwards.
+
+    The path defaults to the one ``database`` used by the time the operation
+    is done.
+
+    """
+    record = Timing()
+    start = time.monotonic()
+    try:
+        yield record
+    finally:
+        if _listeners:
+            if path is None:
+                path = 'sql' if database.native else 'subprocess'
+            notify(Event(operation, db_name, time.monotonic() - start,
+                         path, record.retries))
+
+
+def instrumented(operation, attr=None, path=None):
+    """Decorate a method of a database object to emit an `Event`.
+
+    The name of the database is taken from the attribute of the database
+    object named ``attr`` if given or else from the first argument.
+
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kw):
+            if attr is not None:
+                db_name = getattr(self, attr)
+            else:
+                db_name = args[0] if args else None
+            with timing(self, operation, db_name, path):
+                return func(self, *args, **kw)
+        return wrapper
+    return decorator
+
+
+class Summary:
+    """Aggregate events per operation and path.
+
+    Call `install` to collect the events of the current process and print a
+    table when it exits.
+
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            stats = self.stats.setdefault(
+                (event.operation, event.path),
+                dict(count=0, total=0.0, max=0.0, retries=0))
+            stats['count'] += 1
+            stats['total'] += event.duration
+            stats['max'] = max(stats['max'], event.duration)
+            stats['retries'] += event.retries
+
+    @classmethod
+    def install(cls, file=None):
+        summary = cls()
+        subscribe(summary)
+        atexit.register(summary.report, file)
+        return summary
+
+    def report(self, file=None):
+        if file is None:
+            file = sys.stderr
+        if not self.stats:
+            return
+        print('\ngocept.testdb timings:', file=file)
+        print('{:<20} {:<10} {:>7} {:>10} {:>10} {:>10} {:>7}'.format(
+            'operation', 'path', 'count', 'total [s]', 'mean [ms]',
+            'max [ms]', 'retries'), file=file)
+        for (operation, path), stats in sorted(
+                self.stats.items(), key=lambda item: -item[1]['total']):
+            print('{:<20} {:<10} {:>7} {:>10.3f} {:>10.1f} {:>10.1f} {:>7}'
+                  .format(operation, path, stats['count'], stats['total'],
+                          stats['total'] / stats['count'] * 1000,
+                          stats['max'] * 1000, stats['retries']), file=file)
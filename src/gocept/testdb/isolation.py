@@ -0,0 +1,47 @@
+class TransactionIsolation:
+    """Isolate tests sharing one database by rolling back their changes.
+
+    ``database`` is a `PostgreSQL` or `MySQL` instance. `setUp` creates the
+    database (including its schema) once, `testSetUp` opens a connection for
+    each test, begins a transaction and a nested savepoint on it and
+    `testTearDown` rolls everything back. This is much faster than creating a
+    database for each test.
+
+    Tests need to use `connection` for all their work. Code that manages its
+    own transactions should use savepoints (``connection.begin_nested()``),
+    e.g. by passing ``join_transaction_mode='create_savepoint'`` to an ORM
+    session bound to the connection. Note that MySQL implicitly commits most
+    DDL statements, which cannot be rolled back.
+
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.engine = None
+        self.connection = None
+        self._transaction = None
+        self._savepoint = None
+
+    def setUp(self):
+        """Create the shared database."""
+        self.database.create()
+        self.engine = self.database.create_engine()
+
+    def tearDown(self):
+        """Drop the shared database."""
+        self.engine.dispose()
+        self.engine = None
+        self.database.drop()
+
+    def testSetUp(self):
+        """Begin the transaction of a test and return its connection."""
+        self.connection = self.engine.connect()
+        self._transaction = self.connection.begin()
+        self._savepoint = self.connection.begin_nested()
+        return self.connection
+
+    def testTearDown(self):
+        """Roll back all changes made by a test."""
+        self._transaction.rollback()
+        self.connection.close()
+        self.connection = self._transaction = self._savepoint = None
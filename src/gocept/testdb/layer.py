@@ -0,0 +1,71 @@
+import sys
+
+
+class DatabaseLayer:
+    """zope.testrunner layer providing a database of its own to each test.
+
+    ``database`` is a `PostgreSQL` or `MySQL` instance. `setUp` sets up its
+    template database once for the layer, if it has one. `testSetUp` clones
+    a database from the template, or else creates it from the schema, and
+    makes it available as `db`. `testTearDown` only closes the connections
+    to the database; the databases are dropped in batches of
+    ``drop_batch_size``, ``drop_concurrency`` at a time, and the rest of them
+    in `tearDown`.
+
+    Test databases get random names and only the databases created by the
+    layer are dropped, so the runner's parallel subprocesses (``-j``) do not
+    interfere with each other. The template database is built while holding
+    a lock on the server, so only one of them builds it.
+
+    """
+
+    def __init__(self, database, name='DatabaseLayer', module=None, bases=(),
+                 drop_batch_size=20, drop_concurrency=4):
+        self.database = database
+        self.__name__ = name
+        if module is None:
+            module = sys._getframe(1).f_globals['__name__']
+        self.__module__ = module
+        self.__bases__ = tuple(bases)
+        self.drop_batch_size = drop_batch_size
+        self.drop_concurrency = drop_concurrency
+        self.db = None
+        self._to_drop = []
+
+    def __repr__(self):
+        return '<{} {}.{}>'.format(
+            type(self).__name__, self.__module__, self.__name__)
+
+    def setUp(self):
+        """Set up the template database."""
+        if self.database.db_template:
+            self.database.setup_template()
+
+    def tearDown(self):
+        """Drop the databases still left."""
+        try:
+            self.drop()
+        finally:
+            self.database.dispose()
+
+    def testSetUp(self):
+        """Create the database of a test."""
+        db = self.database._copy(self.database._random_name(), place=True)
+        self._to_drop.append(db.db_name)
+        if db.db_template:
+            db.create_from_template()
+        else:
+            db.create()
+        self.db = db
+
+    def testTearDown(self):
+        """Close the connections to the database of a test."""
+        self.db._dispose_engine(self.db.db_name)
+        self.db = None
+        if len(self._to_drop) >= self.drop_batch_size:
+            self.drop()
+
+    def drop(self):
+        """Drop the databases of the tests run so far."""
+        names, self._to_drop = self._to_drop, []
+        return self.database.drop_dbs(names, self.drop_concurrency)
@@ -1,4 +1,11 @@
 from .base import Database
+from .instrumentation import instrumented
+import contextlib
+import hashlib
+import re
+import sqlalchemy
+import sqlalchemy.exc
+import sqlalchemy.pool
 import subprocess
 
 
@@ -6,12 +13,52 @@ class MySQL(Database):
 
     protocol = 'mysql+pymysql'
     environ_prefix = 'MYSQL'
+    maintenance_db = ''
+    script_dialect = 'mysql'
+    include_pattern = re.compile(
+        rb'\s*(?:source|\\\.)\s+(?P<path>[^\s;]+)',
+        re.IGNORECASE)
+    # Give up waiting for locks when dropping a database after 10 seconds,
+    # like the client programs do:
+    maintenance_connect_args = {
+        'init_command': 'SET SESSION lock_wait_timeout = 10'}
 
     def __init__(self, schema_path=None, prefix=None, db_name=None,
-                 cmd_postfix=''):
-        super().__init__(schema_path, prefix, db_name)
+                 cmd_postfix='', native=False, schema_progress=None,
+                 db_template=None, force_template=False, fast=False,
+                 drop_queue=None):
+        super().__init__(schema_path, prefix, db_name, native=native,
+                         schema_progress=schema_progress, fast=fast,
+                         drop_queue=drop_queue)
         if cmd_postfix:
             self.cmd_postfix = cmd_postfix
+        self.db_template = db_template
+        self.force_template = force_template
+
+    @contextlib.contextmanager
+    def _template_lock(self):
+        """Hold a server-wide named lock specific to the template name."""
+        # Lock names are limited to 64 characters.
+        name = 'gocept.testdb-' + hashlib.sha256(
+            self.db_template.encode('utf-8')).hexdigest()[:40]
+        engine = sqlalchemy.create_engine(
+            self.get_dsn(self.maintenance_db),
+            isolation_level='AUTOCOMMIT', poolclass=sqlalchemy.pool.NullPool)
+        try:
+            with engine.connect() as conn:
+                conn.execute(sqlalchemy.text(
+                    'SELECT GET_LOCK(:name, -1)'), {'name': name})
+                try:
+                    yield
+                finally:
+                    conn.execute(sqlalchemy.text(
+                        'SELECT RELEASE_LOCK(:name)'), {'name': name})
+        finally:
+            engine.dispose()
+
+    def _matches_template_naming_scheme(self, name):
+        return (super()._matches_template_naming_scheme(name) or
+                bool(self.db_template) and name == self.db_template)
 
     def login_args(self, command, extra_args=()):
         args = [
@@ -26,28 +73,139 @@ class MySQL(Database):
         args.extend(extra_args)
         return args
 
+    @instrumented('create_db')
     def create_db(self, db_name):
-        call = self.login_args('mysqladmin', ['create', db_name])
-        try:
-            assert 0 == subprocess.call(call), " ".join(call)
-        except OSError as e:  # pragma: no cover
-            raise AssertionError(str(e), " ".join(call))
+        if self._use_native():
+            self._execute('CREATE DATABASE ' + quote_identifier(db_name))
+        else:
+            call = self.login_args('mysqladmin', ['create', db_name])
+            try:
+                assert 0 == subprocess.call(call), " ".join(call)
+            except OSError as e:  # pragma: no cover
+                raise AssertionError(str(e), " ".join(call))
+        self._created(db_name)
+
+    @instrumented('create_schema')
+    def create_schema(self, db_name, paths=None):
+        marker = self._marker_sql(db_name, replace=paths is not None)
+        mysql_args = [db_name]
+        if self.fast:
+            marker += 'COMMIT;\n'
+            mysql_args.insert(0, '--init-command=' + FAST_SESSION_SQL)
+        if paths is None:
+            paths = self._schema_files()
+        if self._use_native():
+            self._execute_statements(
+                db_name, self._schema_batches(marker, paths))
+            return
+        process = subprocess.Popen(
+            self.login_args('mysql', mysql_args), stdin=subprocess.PIPE)
+        self._write_schema(process.stdin, marker, paths)
+        assert 0 == process.wait()
 
-    def create_schema(self, db_name):
-        assert 0 == subprocess.call(
-            self.login_args('mysql', [db_name]), stdin=open(self.schema_path))
+    def _reset_session_sql(self, db_name):
+        # Dumps of whole databases switch to them.
+        return 'USE {};\n'.format(quote_identifier(db_name))
 
+    def _script_engine(self, db_name):
+        import pymysql.constants.CLIENT
+        connect_args = {
+            'client_flag': pymysql.constants.CLIENT.MULTI_STATEMENTS}
+        if self.fast:
+            connect_args['init_command'] = FAST_SESSION_SQL
+        return sqlalchemy.create_engine(
+            self.get_dsn(db_name), connect_args=connect_args)
+
+    def _consume_results(self, cursor):
+        while cursor.nextset():
+            pass
+
+    @instrumented('list_db_names')
     def list_db_names(self):
+        if self._use_native():
+            return [row[0] for row in self._execute('SHOW DATABASES')]
         raw_list, _ = subprocess.Popen(self.login_args('mysqlshow'),
                                        stdout=subprocess.PIPE).communicate()
         return [line.decode('us-ascii').split()[1]
                 for line in raw_list.splitlines()[3:-1]]
 
-    def drop_db(self, db_name):
+    def _db_exists_native(self, db_name):
+        return bool(self._execute(
+            'SELECT 1 FROM information_schema.SCHEMATA'
+            ' WHERE SCHEMA_NAME = :name', name=db_name))
+
+    def _copy_db(self, source, target):
+        # There are no template databases, so copy table by table. Views,
+        # triggers and routines are not copied.
+        self.create_db(target)
+        tables = self._execute(
+            "SELECT TABLE_NAME FROM information_schema.TABLES"
+            " WHERE TABLE_SCHEMA = :schema AND TABLE_TYPE = 'BASE TABLE'",
+            schema=source)
+        engine = self.create_engine(target)
         try:
-            assert 0 == subprocess.call(
-                self.login_args('mysqladmin', ['--force', 'drop', db_name]),
-                timeout=10  # seconds
-            )
-        except subprocess.TimeoutExpired:  # pragma: no cover
-            pass
+            conn = engine.raw_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(FAST_SESSION_SQL if self.fast else
+                               'SET SESSION FOREIGN_KEY_CHECKS = 0')
+                for table, in tables:
+                    cursor.execute('SHOW CREATE TABLE {}.{}'.format(
+                        quote_identifier(source), quote_identifier(table)))
+                    cursor.execute(cursor.fetchone()[1])
+                    cursor.execute('INSERT INTO {} SELECT * FROM {}.{}'.format(
+                        quote_identifier(table), quote_identifier(source),
+                        quote_identifier(table)))
+                cursor.close()
+                conn.commit()
+            finally:
+                conn.close()
+        except (sqlalchemy.exc.SQLAlchemyError,
+                engine.dialect.dbapi.Error) as e:
+            raise AssertionError(str(e))
+        finally:
+            engine.dispose()
+
+    def _db_ages(self):
+        # A database is as old as the first table created in it.
+        return dict(self._execute(
+            'SELECT TABLE_SCHEMA,'
+            ' TIMESTAMPDIFF(SECOND, MIN(CREATE_TIME), NOW())'
+            ' FROM information_schema.TABLES GROUP BY TABLE_SCHEMA'))
+
+    @instrumented('drop_db')
+    def drop_db(self, db_name):
+        self._dispose_engine(db_name)
+        if self._use_native():
+            self._kill_connections(db_name)
+            self._execute('DROP DATABASE ' + quote_identifier(db_name))
+        else:
+            try:
+                assert 0 == subprocess.call(
+                    self.login_args(
+                        'mysqladmin', ['--force', 'drop', db_name]),
+                    timeout=10  # seconds
+                )
+            except subprocess.TimeoutExpired as e:
+                raise AssertionError(str(e))
+        self._dropped(db_name)
+
+    def _kill_connections(self, db_name):
+        # Open transactions of other clients would make dropping wait.
+        for connection_id, in self._execute(
+                'SELECT ID FROM information_schema.PROCESSLIST'
+                ' WHERE DB = :name AND ID <> CONNECTION_ID()', name=db_name):
+            try:
+                self._execute('KILL %d' % connection_id)
+            except AssertionError:  # pragma: no cover
+                # The connection has gone away meanwhile.
+                pass
+
+
+# Load data in one transaction without checking keys, like dumps do.
+FAST_SESSION_SQL = (
+    'SET SESSION autocommit = 0, unique_checks = 0, foreign_key_checks = 0')
+
+
+def quote_identifier(name):
+    return '`%s`' % name.replace('`', '``')
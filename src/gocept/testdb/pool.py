@@ -0,0 +1,172 @@
+import collections
+import threading
+import time
+
+
+class Pool:
+    """Keep a number of test databases cloned from a template ready for use.
+
+    ``database`` is a `PostgreSQL` instance with a ``db_template``. Databases
+    handed out by `acquire` are cloned from that template in a background
+    thread, so a test only waits if the pool has run dry. Databases given
+    back via `release` are dropped in the background and replaced by fresh
+    clones.
+
+    """
+
+    def __init__(self, database, size=4):
+        if not database.db_template:
+            raise ValueError('A pool requires a database with a db_template.')
+        self.database = database
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.wait_time = 0.0
+        self._ready = collections.deque()
+        self._to_drop = []
+        self._condition = threading.Condition()
+        # Serialises cloning from the template with rebuilding it:
+        self._template_lock = threading.Lock()
+        self._generation = 0
+        self._schema_mtime = None
+        self._schema_digest = None
+        self._error = None
+        self._closed = False
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        """Set up the template and start filling the pool."""
+        with self._template_lock:
+            self._setup_template()
+        self._thread = threading.Thread(
+            target=self._run, name='gocept.testdb.pool', daemon=True)
+        self._thread.start()
+
+    def acquire(self):
+        """Return a database object for a freshly cloned database.
+
+        The pool is invalidated first if the schema has changed since the
+        template was set up. The schema's content is only compared if the
+        file's modification time has changed.
+
+        """
+        mtime = self.database._schema_mtime()
+        if mtime != self._schema_mtime:
+            if self.database._schema_digest() != self._schema_digest:
+                self.invalidate()
+            else:
+                self._schema_mtime = mtime
+        start = time.monotonic()
+        with self._condition:
+            if self._ready:
+                self.hits += 1
+            else:
+                self.misses += 1
+                while not self._ready:
+                    self._check()
+                    self._condition.wait()
+                self.wait_time += time.monotonic() - start
+            db = self._ready.popleft()
+            self._condition.notify_all()
+        return db
+
+    def release(self, db):
+        """Hand a database back to the pool to have it dropped."""
+        with self._condition:
+            self._to_drop.append(db.db_name)
+            self._condition.notify_all()
+
+    def invalidate(self):
+        """Discard all pooled databases and bring the template up to date."""
+        with self._template_lock:
+            with self._condition:
+                self._generation += 1
+                self._to_drop.extend(db.db_name for db in self._ready)
+                self._ready.clear()
+            self._setup_template()
+        with self._condition:
+            self._condition.notify_all()
+
+    def close(self):
+        """Stop refilling the pool and drop all databases it still holds."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._condition:
+            names = self._to_drop + [db.db_name for db in self._ready]
+            self._to_drop = []
+            self._ready.clear()
+        for name in names:
+            self._drop(name)
+
+    @property
+    def stats(self):
+        return dict(
+            hits=self.hits, misses=self.misses, wait_time=self.wait_time)
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError(
+                'Could not fill the database pool: %s' % self._error)
+        if self._closed:
+            raise RuntimeError('The database pool has been closed.')
+
+    def _setup_template(self):
+        self.database.setup_template()
+        self._schema_mtime = self.database._schema_mtime()
+        self._schema_digest = self.database._schema_digest()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not (self._closed or self._to_drop or
+                           len(self._ready) < self.size):
+                    self._condition.wait()
+                if self._closed:
+                    return
+                to_drop, self._to_drop = self._to_drop, []
+                refill = len(self._ready) < self.size
+                generation = self._generation
+            for name in to_drop:
+                self._drop(name)
+            if not refill:
+                continue
+            try:
+                with self._template_lock:
+                    if generation != self._generation:
+                        continue
+                    db = self._clone()
+            except (Exception, SystemExit) as e:
+                with self._condition:
+                    self._error = e
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                if generation == self._generation and not self._closed:
+                    self._ready.append(db)
+                else:  # pragma: no cover
+                    self._to_drop.append(db.db_name)
+                self._condition.notify_all()
+
+    def _clone(self):
+        db = self.database._copy(self.database._random_name(), place=True)
+        db.create_from_template()
+        return db
+
+    def _drop(self, name):
+        try:
+            self.database._copy(name, place=True).drop()
+        except Exception:  # pragma: no cover
+            # Left-overs follow the naming scheme and are removed by
+            # ``drop_all`` or the ``drop-all`` script.
+            pass
@@ -1,22 +1,34 @@
 from .base import Database
+from .instrumentation import instrumented
+import contextlib
+import hashlib
 import os
+import re
 import sqlalchemy
+import sqlalchemy.pool
 import subprocess
+import time
 
 
 class PostgreSQL(Database):
 
     protocol = 'postgresql'
     environ_prefix = 'POSTGRES'
+    maintenance_db = 'postgres'
+    script_dialect = 'postgresql'
+    include_pattern = re.compile(
+        rb'\s*\\(?:i|include|(?P<relative>ir|include_relative))'
+        rb'\s+(?P<path>\S+)')
 
     def __init__(self, encoding=None, db_template=None,
                  force_template=False, lc_collate=None,
-                 *args, **kw):
+                 *args, template_replicas=0, **kw):
         super().__init__(*args, **kw)
         self.encoding = encoding
         self.db_template = db_template
         self.lc_collate = lc_collate
         self.force_template = force_template
+        self.template_replicas = template_replicas
 
     def login_args(self, command, extra_args=()):
         args = [
@@ -29,63 +41,192 @@ class PostgreSQL(Database):
         args.extend(extra_args)
         return args
 
-    def create(self):
-        if self.db_template:
-            try:
-                self.create_template()
-            except SystemExit as e:
+    @contextlib.contextmanager
+    def _template_lock(self):
+        """Hold a server-wide advisory lock specific to the template name."""
+        key = int(hashlib.sha256(
+            self.db_template.encode('utf-8')).hexdigest()[:15], 16)
+        engine = sqlalchemy.create_engine(
+            self.get_dsn(self.maintenance_db),
+            isolation_level='AUTOCOMMIT', poolclass=sqlalchemy.pool.NullPool)
+        try:
+            with engine.connect() as conn:
+                conn.execute(sqlalchemy.text(
+                    'SELECT pg_advisory_lock(:key)'), {'key': key})
                 try:
-                    self.drop_db(self.db_template)
-                except BaseException:  # pragma: no cover
-                    pass
-                raise e
+                    yield
+                finally:
+                    conn.execute(sqlalchemy.text(
+                        'SELECT pg_advisory_unlock(:key)'), {'key': key})
+        finally:
+            engine.dispose()
+
+    def _template_set_up(self, rebuilt):
+        self._setup_template_replicas(rebuilt)
+
+    def _update_template(self):
+        # Apply schema files added since the template was built.
+        applied = self._get_db_file_digests(self.db_template)
+        files = self._schema_file_digests()
+        if not applied or files[:len(applied)] != applied:
+            return False
+        paths = self._schema_files()[len(applied):]
+        name = self._random_name()
+        try:
+            self.create_db(name, db_template=self.db_template)
+        except AssertionError:  # pragma: no cover
+            return False
+        try:
+            self.create_schema(name, paths)
+        except AssertionError:
+            self.drop_db(name)
+            return False
+        self.drop_db(self.db_template)
+        self._rename_db(name, self.db_template)
+        return True
+
+    @property
+    def template_source(self):
+        """Name of the database test databases are cloned from.
+
+        With template replicas, each process uses its own replica, chosen by
+        its ``pytest-xdist`` worker number or else its process id.
+
+        """
+        if not self.template_replicas:
+            return self.db_template
+        worker = os.environ.get('PYTEST_XDIST_WORKER', '')
+        if worker.startswith('gw') and worker[2:].isdigit():
+            index = int(worker[2:])
+        else:
+            index = os.getpid()
+        return self._replica_name(index % self.template_replicas)
+
+    def _replica_name(self, index):
+        return '{}-replica-{}'.format(self.db_template, index)
+
+    def _matches_replica_naming_scheme(self, name):
+        """Check whether name is one of the replicas of the template."""
+        if not self.db_template:
+            return False
+        return bool(re.match(
+            re.escape(self.db_template) + r'-replica-\d+$', name))
+
+    def _matches_template_naming_scheme(self, name):
+        """Check whether name is the template or one of its replicas."""
+        if super()._matches_template_naming_scheme(name):
+            return True
+        if self.db_template and name == self.db_template:
+            return True
+        return self._matches_replica_naming_scheme(name)
+
+    def _setup_template_replicas(self, rebuilt):
+        """Clone the replicas of the template database that are missing.
+
+        All replicas are cloned afresh if the template was rebuilt, which
+        also removes replicas no longer wanted.
+
+        """
+        if not (self.template_replicas or rebuilt):
+            return
+        existing = set(self.list_db_names())
+        wanted = {self._replica_name(i) for i in range(self.template_replicas)}
+        for name in sorted(existing):
+            if not self._matches_replica_naming_scheme(name):
+                continue
+            if rebuilt or name not in wanted:
+                self.drop_db(name)
+                existing.discard(name)
+        for name in sorted(wanted):
+            if name in existing:
+                continue
             try:
-                self.create_db(
-                    self.db_name,
-                    db_template=self.db_template)
+                self.create_db(name, db_template=self.db_template)
             except AssertionError:  # pragma: no cover
                 raise SystemExit(
-                    "Could not create database %r from template %r" %
-                    (self.db_name, self.db_template))
-        else:
-            self.create_db_from_schema(self.db_name)
+                    "Could not create template replica %r" % name)
 
-    def create_template(self):
-        if self.schema_path is None:
-            schema_mtime = 0
+    @instrumented('create_db')
+    def create_db(self, db_name, db_template=None, lc_collate=None):
+        if self._use_native():
+            self._execute(self._create_db_sql(db_name, db_template))
+            if self.fast:
+                self._execute(self._fast_db_sql(db_name))
+        elif self.fast:
+            # Set up the database in one call to psql instead of createdb.
+            args = self.login_args('psql', [
+                '--quiet', '-v', 'ON_ERROR_STOP=true',
+                '-c', self._create_db_sql(db_name, db_template),
+                '-c', self._fast_db_sql(db_name), self.maintenance_db])
+            assert 0 == subprocess.call(args), " ".join(args)
         else:
-            schema_mtime = int(os.path.getmtime(self.schema_path))
+            create_args = []
+            if db_template is not None:
+                create_args.extend(['-T', db_template])
+            if self.lc_collate is not None:
+                create_args.extend(['--lc-collate', self.lc_collate])
+                create_args.extend(['-T', 'template0'])
+            if self.encoding:
+                create_args.extend(['-E', self.encoding])
+            args = self.login_args('createdb', create_args + [db_name])
+            assert 0 == subprocess.call(args), " ".join(args)
+        self._created(db_name)
 
-        if self.db_template in self.list_db_names():
-            template_mtime = self._get_db_mtime(self.db_template)
-            if self.force_template or schema_mtime != template_mtime:
-                self.drop_db(self.db_template)
-            else:
-                return
+    def _fast_db_sql(self, db_name):
+        # Settings of the template are not copied.
+        return 'ALTER DATABASE {} SET synchronous_commit = off'.format(
+            quote_identifier(db_name))
 
-        self.create_db_from_schema(self.db_template)
-        self._set_db_mtime(self.db_template, schema_mtime)
-
-    def create_db(self, db_name, db_template=None, lc_collate=None):
-        create_args = []
-        if db_template is not None:
-            create_args.extend(['-T', self.db_template])
+    def _create_db_sql(self, db_name, db_template=None):
+        statement = 'CREATE DATABASE ' + quote_identifier(db_name)
         if self.lc_collate is not None:
-            create_args.extend(['--lc-collate', self.lc_collate])
-            create_args.extend(['-T', 'template0'])
+            statement += ' LC_COLLATE ' + quote_literal(self.lc_collate)
+            db_template = 'template0'
+        if db_template is not None:
+            statement += ' TEMPLATE ' + quote_identifier(db_template)
         if self.encoding:
-            create_args.extend(['-E', self.encoding])
-        args = self.login_args('createdb', create_args + [db_name])
-        assert 0 == subprocess.call(args), " ".join(args)
+            statement += ' ENCODING ' + quote_literal(self.encoding)
+        return statement
+
+    @instrumented('create_schema')
+    def create_schema(self, db_name, paths=None):
+        marker = self._marker_sql(db_name, replace=paths is not None)
+        if self.fast:
+            marker += UNLOGGED_SQL
+        if paths is None:
+            paths = self._schema_files()
+        if self._use_native():
+            self._execute_statements(
+                db_name, self._schema_batches(marker, paths))
+            return
+        # Run the schema and the marker in one transaction. psql reads the
+        # files itself, so ``\ir`` finds files relative to the including one,
+        # but progress is only known before and after.
+        args = ['--single-transaction', '-v', 'ON_ERROR_STOP=true', '--quiet']
+        for path in paths:
+            args.extend(['-f', path])
+        args.extend(['-c', marker, db_name])
+        total = sum(os.path.getsize(path) for path in paths)
+        self._report_progress(0, total)
+        assert 0 == subprocess.call(self.login_args('psql', args))
+        self._report_progress(total, total)
+
+    def _reset_session_sql(self, db_name):
+        # Dumps empty the search_path, for example.
+        return 'RESET ALL;\n'
 
-    def create_schema(self, db_name):
-        assert 0 == subprocess.call(
-            self.login_args(
-                'psql', ['-f', self.schema_path,
-                         '-v', 'ON_ERROR_STOP=true', '--quiet',
-                         db_name]))
+    def _copy_from(self, cursor, copy):
+        cursor.copy_expert(copy.statement, copy, size=1 << 16)
 
+    @instrumented('list_db_names')
     def pg_list_db_items(self):
+        if self._use_native():
+            return [list(row) for row in self._execute(
+                "SELECT d.datname, pg_catalog.pg_get_userbyid(d.datdba),"
+                " pg_catalog.pg_encoding_to_char(d.encoding),"
+                " d.datcollate, d.datctype,"
+                " COALESCE(pg_catalog.array_to_string(d.datacl, ','), '')"
+                " FROM pg_catalog.pg_database d ORDER BY 1")]
         # Use unaligned output to simplify splitting.
         raw_list, _ = subprocess.Popen(self.login_args('psql', ['-l', '-A']),
                                        stdout=subprocess.PIPE).communicate()
@@ -99,49 +240,164 @@ class PostgreSQL(Database):
     def list_db_names(self):
         return [items[0] for items in self.pg_list_db_items()]
 
-    def _get_db_mtime(self, database):
-        dsn = self.get_dsn(database)
-        conn = sqlalchemy.create_engine(dsn).connect()
-        result = next(conn.execute(sqlalchemy.text(
-            'SELECT schema_mtime FROM tmp_functest;'
-        )).cursor)
-        conn.invalidate()
-        conn.close()
-        if result:
-            result = result[0]
+    def _db_exists_native(self, db_name):
+        return bool(self._execute(
+            'SELECT 1 FROM pg_catalog.pg_database WHERE datname = :name',
+            name=db_name))
+
+    def _rename_db(self, db_name, new_name):
+        statement = 'ALTER DATABASE {} RENAME TO {}'.format(
+            quote_identifier(db_name), quote_identifier(new_name))
+        self._dispose_engine(db_name)
+        self._execute_maintenance(statement)
+        self._dropped(db_name)
+        self._created(new_name)
+
+    def _retire(self):
+        # Renaming is quick, frees the name and leaves a name following the
+        # naming scheme for drop_all to collect.
+        self._dispose_engine(self.db_name)
+        # The server would wait for up to 5 seconds for other clients to
+        # disconnect. Give connections just closed a moment to go away.
+        for i in range(10):
+            if not self._execute(
+                    'SELECT 1 FROM pg_catalog.pg_stat_activity'
+                    ' WHERE datname = :name', name=self.db_name):
+                break
+            time.sleep(0.02)
         else:
-            result = 0
-        return result
+            return self.db_name
+        name = self._random_name()
+        try:
+            self._rename_db(self.db_name, name)
+        except AssertionError:
+            return self.db_name
+        return name
 
-    def _set_db_mtime(self, database, mtime):
-        dsn = self.get_dsn(database)
-        engine = sqlalchemy.create_engine(dsn)
-        with engine.begin() as conn:
-            conn.execute(
-                sqlalchemy.text(
-                    'INSERT INTO tmp_functest (schema_mtime) VALUES (:mtime);'
-                ),
-                {"mtime": mtime}
-            )
-        engine.dispose()
-
-    def drop_all(self, drop_template=False):
-        for name in self.list_db_names():
-            if (name == self.db_template and drop_template or
-                    self._matches_db_naming_scheme(name)):
-                self.drop_db(name)
+    def _execute_maintenance(self, statement):
+        if self._use_native():
+            self._execute(statement)
+        else:
+            assert 0 == subprocess.call(self.login_args('psql', [
+                '--quiet', '-c', statement, self.maintenance_db]))
 
-    def drop_db(self, db_name):
+    def _copy_db(self, source, target):
+        self.create_db(target, db_template=source)
+
+    def _db_ages(self):
+        # There is no creation time in the catalogue, but the version file
+        # in the data directory of a database is written on creation.
+        # Reading it requires superuser or pg_read_server_files privileges,
+        # without them the ages are unknown. Databases in other tablespaces
+        # have no such file there and are left out.
         try:
-            assert 0 == subprocess.call(self.login_args('dropdb', [db_name]))
+            rows = self._execute(
+                "SELECT datname, EXTRACT(EPOCH FROM now() - (pg_stat_file("
+                "'base/' || oid || '/PG_VERSION', true)).modification)"
+                " FROM pg_database WHERE datallowconn")
         except AssertionError:
-            for command in [
-                ("UPDATE pg_database SET datallowconn = false "
-                 "WHERE datname = '" + db_name + "'"),
-                'ALTER DATABASE "' + db_name + '" CONNECTION LIMIT 1',
-                ("SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
-                 "WHERE datname = '" + db_name + "'"),
-            ]:
-                subprocess.call(self.login_args('psql', [
-                    '--dbname=postgres', '-c', command]))
-            assert 0 == subprocess.call(self.login_args('dropdb', [db_name]))
+            return {}
+        return {name: age for name, age in rows if age is not None}
+
+    @instrumented('drop_db')
+    def drop_db(self, db_name):
+        self._dispose_engine(db_name)
+        if self._use_native():
+            self._drop_db_native(db_name)
+        else:
+            self._drop_db_subprocess(db_name)
+        self._dropped(db_name)
+
+    def _drop_db_subprocess(self, db_name):
+        # Each statement is run in a transaction of its own.
+        args = ['--quiet', '-v', 'ON_ERROR_STOP=true']
+        for statement in self._drop_statements(db_name):
+            args.extend(['-c', statement])
+        args.append(self.maintenance_db)
+        assert 0 == subprocess.call(self.login_args('psql', args)), db_name
+
+    def _drop_db_native(self, db_name):
+        for statement in self._drop_statements(db_name):
+            self._execute(statement)
+
+    def _drop_statements(self, db_name):
+        """Return statements dropping a database others are connected to.
+
+        Otherwise the server would wait for up to 5 seconds for the other
+        clients to disconnect and then give up.
+
+        """
+        statement = 'DROP DATABASE ' + quote_identifier(db_name)
+        if self._server_version() >= (13,):
+            return [statement + ' WITH (FORCE)']
+        # Older servers cannot force the drop themselves:
+        return [
+            'ALTER DATABASE ' + quote_identifier(db_name) +
+            ' ALLOW_CONNECTIONS false',
+            'SELECT pg_terminate_backend(pid) FROM pg_stat_activity'
+            ' WHERE datname = ' + quote_literal(db_name),
+            statement,
+        ]
+
+    def _server_version(self):
+        key = self._catalogue_key()
+        if key not in server_versions:
+            if self._use_native():
+                engine = self.maintenance_engine()
+                if getattr(engine.dialect, 'server_version_info',
+                           None) is None:
+                    engine.connect().close()
+                version = engine.dialect.server_version_info
+            else:
+                output = subprocess.check_output(self.login_args('psql', [
+                    '-A', '-t', '-c', 'SHOW server_version_num',
+                    self.maintenance_db]))
+                number = int(output)
+                if number >= 100000:
+                    version = (number // 10000, number % 10000)
+                else:
+                    version = (number // 10000, number // 100 % 100)
+            server_versions[key] = tuple(version)
+        return server_versions[key]
+
+
+# Versions of the servers by protocol, host and port
+server_versions = {}
+
+# Make the tables of a database unlogged, which saves writing them to the
+# write-ahead log. Tables referenced by a logged table, for example in a
+# cycle of foreign keys, cannot be converted and are left alone.
+UNLOGGED_SQL = """\
+DO $gocept_testdb$
+DECLARE
+    table_oid oid;
+    converted boolean := true;
+BEGIN
+    WHILE converted LOOP
+        converted := false;
+        FOR table_oid IN
+            SELECT c.oid FROM pg_catalog.pg_class c
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind = 'r' AND c.relpersistence = 'p'
+            AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+        LOOP
+            BEGIN
+                EXECUTE format('ALTER TABLE %s SET UNLOGGED',
+                               table_oid::regclass);
+                converted := true;
+            EXCEPTION WHEN others THEN
+                NULL;
+            END;
+        END LOOP;
+    END LOOP;
+END
+$gocept_testdb$;
+"""
+
+
+def quote_identifier(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def quote_literal(value):
+    return "'%s'" % value.replace("'", "''")
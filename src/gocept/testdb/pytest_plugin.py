@@ -0,0 +1,220 @@
+from .isolation import TransactionIsolation
+from .mysql import MySQL
+from .pool import Pool
+from .postgres import PostgreSQL
+from .server import MySQLServer
+from .server import PostgreSQLServer
+from .server import shared
+import os
+import pytest
+
+
+ISOLATION = ('database', 'transaction', 'pool')
+
+
+def pytest_addoption(parser):
+    parser.addini(
+        'testdb_schema', type='linelist', default=[],
+        help='gocept.testdb: schema files or directories, relative to the'
+        ' configuration file')
+    parser.addini(
+        'testdb_template', default='',
+        help='gocept.testdb: name of the template database test databases'
+        ' are cloned from')
+    parser.addini(
+        'testdb_prefix', default='testdb',
+        help='gocept.testdb: prefix of the names of test databases')
+    parser.addini(
+        'testdb_isolation', default='database',
+        help='gocept.testdb: one of {}; a database per test, a shared'
+        ' database rolled back after each test or a database per test from'
+        ' a pool'.format(', '.join(ISOLATION)))
+    parser.addini(
+        'testdb_pool_size', default='4',
+        help='gocept.testdb: number of databases kept ready by the pool')
+    parser.addini(
+        'testdb_native', type='bool', default=False,
+        help='gocept.testdb: use SQL instead of the client programs')
+    parser.addini(
+        'testdb_fast', type='bool', default=False,
+        help='gocept.testdb: trade durability for speed')
+    parser.addini(
+        'testdb_server', type='bool', default=False,
+        help='gocept.testdb: run a throwaway database server for the session'
+        ' instead of using an existing one')
+    parser.addini(
+        'testdb_drop_concurrency', default='4',
+        help='gocept.testdb: number of databases dropped at the same time at'
+        ' the end of the session')
+
+
+class Session:
+    """Test databases of one database engine used during a test session.
+
+    The template database is set up once, before the first test needing a
+    database. How tests are isolated from each other depends on the
+    ``testdb_isolation`` option:
+
+    ``database``
+        Each test gets a database of its own, cloned from the template or
+        else created from the schema. The databases are dropped together
+        at the end of the session.
+    ``transaction``
+        All tests share one database through a `TransactionIsolation`.
+    ``pool``
+        Each test gets a database from a `Pool`, which requires a template.
+
+    The template database is built while holding a lock on the server, so
+    concurrent ``pytest-xdist`` workers build it only once. If the
+    ``testdb_server`` option is true, a throwaway server is started for the
+    process instead.
+
+    """
+
+    def __init__(self, factory, config, server_class):
+        if config.getini('testdb_server'):
+            shared(server_class)
+        self.isolation = config.getini('testdb_isolation')
+        if self.isolation not in ISOLATION:
+            raise pytest.UsageError(
+                'testdb_isolation must be one of {}, not {!r}'.format(
+                    ', '.join(ISOLATION), self.isolation))
+        schema = schema_paths(config)
+        if len(schema) == 1:
+            schema = schema[0]
+        self.database = factory(
+            schema_path=schema or None,
+            prefix=config.getini('testdb_prefix'),
+            db_template=config.getini('testdb_template') or None,
+            native=config.getini('testdb_native'),
+            fast=config.getini('testdb_fast'))
+        if self.isolation == 'pool' and not self.database.db_template:
+            raise pytest.UsageError(
+                'testdb_isolation = pool requires a testdb_template')
+        self.pool_size = int(config.getini('testdb_pool_size'))
+        self.drop_concurrency = int(
+            config.getini('testdb_drop_concurrency'))
+        self.created = []
+        self.pool = None
+        self.transaction = None
+
+    def start(self):
+        if self.isolation == 'transaction':
+            self.transaction = TransactionIsolation(self.database)
+            self.transaction.setUp()
+        elif self.isolation == 'pool':
+            self.pool = Pool(self.database, size=self.pool_size)
+            self.pool.start()
+        elif self.database.db_template:
+            self.database.setup_template()
+
+    def close(self):
+        try:
+            if self.transaction is not None:
+                self.transaction.tearDown()
+            if self.pool is not None:
+                self.pool.close()
+            self.database.drop_dbs(self.created, self.drop_concurrency)
+        finally:
+            self.database.dispose()
+
+    def acquire(self):
+        """Return a database object for the database a test uses."""
+        if self.transaction is not None:
+            return self.database
+        if self.pool is not None:
+            return self.pool.acquire()
+        db = self.database._copy(self.database._random_name(), place=True)
+        self.created.append(db.db_name)
+        if db.db_template:
+            db.create_from_template()
+        else:
+            db.create()
+        return db
+
+    def release(self, db):
+        """Close the connections a test left to its database."""
+        if self.pool is not None:
+            self.pool.release(db)
+        elif self.transaction is None:
+            db._dispose_engine(db.db_name)
+
+    def connect(self, db):
+        """Return a connection whose changes do not outlast the test."""
+        if self.transaction is not None:
+            return self.transaction.testSetUp()
+        return db.get_engine().connect()
+
+    def disconnect(self, connection):
+        if self.transaction is not None:
+            self.transaction.testTearDown()
+        else:
+            connection.close()
+
+
+def schema_paths(config):
+    """Return the ``testdb_schema`` paths relative to the configuration file.
+
+    Resolved here as the ``paths`` type of ini options requires pytest 7.
+
+    """
+    if hasattr(config, 'inipath'):
+        inifile = config.inipath
+    else:  # pytest < 6.1
+        inifile = config.inifile
+    if inifile:
+        base = os.path.dirname(str(inifile))
+    else:
+        base = str(config.invocation_params.dir)
+    return [os.path.join(base, path)
+            for path in config.getini('testdb_schema')]
+
+
+@pytest.fixture(scope='session')
+def testdb_postgres_session(request):
+    """The `Session` providing PostgreSQL test databases."""
+    session = Session(PostgreSQL, request.config, PostgreSQLServer)
+    session.start()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def testdb_postgres(testdb_postgres_session):
+    """A `PostgreSQL` object for the database of the current test."""
+    db = testdb_postgres_session.acquire()
+    yield db
+    testdb_postgres_session.release(db)
+
+
+@pytest.fixture
+def testdb_postgres_connection(testdb_postgres_session, testdb_postgres):
+    """An SQLAlchemy connection to the database of the current test."""
+    connection = testdb_postgres_session.connect(testdb_postgres)
+    yield connection
+    testdb_postgres_session.disconnect(connection)
+
+
+@pytest.fixture(scope='session')
+def testdb_mysql_session(request):
+    """The `Session` providing MySQL test databases."""
+    session = Session(MySQL, request.config, MySQLServer)
+    session.start()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def testdb_mysql(testdb_mysql_session):
+    """A `MySQL` object for the database of the current test."""
+    db = testdb_mysql_session.acquire()
+    yield db
+    testdb_mysql_session.release(db)
+
+
+@pytest.fixture
+def testdb_mysql_connection(testdb_mysql_session, testdb_mysql):
+    """An SQLAlchemy connection to the database of the current test."""
+    connection = testdb_mysql_session.connect(testdb_mysql)
+    yield connection
+    testdb_mysql_session.disconnect(connection)
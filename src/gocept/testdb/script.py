@@ -0,0 +1,266 @@
+import re
+
+
+COPY_FROM_STDIN = re.compile(r'COPY\b[^;]*\bFROM\s+stdin\b', re.I)
+STDIN = re.compile('stdin', re.I)
+DOLLAR_TAG = re.compile(r'\$([A-Za-z_][A-Za-z0-9_]*)?\$')
+DELIMITER_COMMAND = re.compile(r'\s*DELIMITER\s+(\S+)', re.I)
+META_COMMAND = re.compile(r'\\(\S*)')
+SKIPPED_META_COMMANDS = frozenset(['restrict', 'unrestrict'])
+IDENTIFIER_CHARS = frozenset(
+    'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_$')
+
+
+class Copy:
+    """A ``COPY ... FROM stdin`` statement followed by its data.
+
+    The data is read as a file, up to the line containing only ``\\.``.
+
+    """
+
+    def __init__(self, statement, lines):
+        self.statement = statement
+        self._lines = lines
+        self._buffer = ''
+        self._done = False
+
+    def _next_line(self):
+        if self._done:
+            return ''
+        for line in self._lines:
+            if line.startswith('\\.') and line.rstrip('\r\n') == '\\.':
+                break
+            return line
+        self._done = True
+        return ''
+
+    def readline(self, size=-1):
+        if not self._buffer:
+            self._buffer = self._next_line()
+        if 0 <= size < len(self._buffer):
+            line, self._buffer = self._buffer[:size], self._buffer[size:]
+        else:
+            line, self._buffer = self._buffer, ''
+        return line
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = self._next_line()
+            if not line:
+                break
+            chunks.append(line)
+            length += len(line)
+        data = ''.join(chunks)
+        if 0 <= size < length:
+            data, self._buffer = data[:size], data[size:]
+        else:
+            self._buffer = ''
+        return data
+
+    def exhaust(self):
+        """Skip the data that has not been read."""
+        while self._next_line():
+            pass
+        self._buffer = ''
+
+
+class Splitter:
+    """Split an SQL script into statements while it is being read.
+
+    Quoted strings and identifiers, comments and PostgreSQL dollar quoting
+    are taken into account. For MySQL, backslash escapes, backticks, ``#``
+    comments and the ``DELIMITER`` client command are understood as well.
+
+    psql meta-commands between PostgreSQL statements cannot be run without
+    psql, so they raise a ValueError. Only ``\\restrict`` and
+    ``\\unrestrict``, which ``pg_dump`` writes to guard the psql session, are
+    skipped.
+
+    """
+
+    def __init__(self, dialect='postgresql'):
+        self.mysql = dialect == 'mysql'
+        self._parts = []
+        # Sequence ending the quote or comment we are in, if any:
+        self._closing = None
+        self._backslash = False
+        self._depth = 0
+        self._has_code = False
+        self.set_delimiter(';')
+
+    def set_delimiter(self, delimiter):
+        self.delimiter = delimiter
+        self._special = re.compile('[%s]' % re.escape(
+            '\'"/-' + ('`#' if self.mysql else '$') + delimiter[0]))
+
+    def feed(self, line):
+        """Return the statements completed by a line of the script."""
+        if self._closing is None and not self._has_code:
+            if self.mysql:
+                match = DELIMITER_COMMAND.match(line)
+                if match is not None:
+                    self.set_delimiter(match.group(1))
+                    return []
+            elif line.startswith('\\'):
+                match = META_COMMAND.match(line)
+                if match.group(1) in SKIPPED_META_COMMANDS:
+                    return []
+                raise ValueError(
+                    'psql meta-command cannot be run without psql: '
+                    + line.rstrip())
+        statements = []
+        start = pos = 0
+        length = len(line)
+        while pos < length:
+            if self._closing is not None:
+                pos = self._skip_quoted(line, pos)
+                continue
+            match = self._special.search(line, pos)
+            end = length if match is None else match.start()
+            if not self._has_code and line[pos:end].strip():
+                self._has_code = True
+            if match is None:
+                break
+            pos = end
+            char = line[pos]
+            if line.startswith(self.delimiter, pos):
+                self._parts.append(line[start:pos])
+                statement = self._pop()
+                if statement is not None:
+                    statements.append(statement)
+                pos = start = pos + len(self.delimiter)
+            elif char in '\'"`':
+                self._has_code = True
+                self._closing = char
+                self._backslash = char == "'" and (
+                    self.mysql or self._escape_string(line, pos))
+                pos += 1
+            elif char == '$':
+                match = DOLLAR_TAG.match(line, pos)
+                if match is None or (
+                        pos and line[pos - 1] in IDENTIFIER_CHARS):
+                    self._has_code = True
+                    pos += 1
+                else:
+                    self._has_code = True
+                    self._closing = match.group()
+                    pos = match.end()
+            elif char == '/' and line.startswith('/*', pos):
+                if self.mysql and line.startswith('/*!', pos):
+                    # Comments executed by MySQL
+                    self._has_code = True
+                self._closing = '*/'
+                self._depth = 1
+                pos += 2
+            elif self._line_comment(line, pos):
+                pos = length
+            else:
+                self._has_code = True
+                pos += 1
+        self._parts.append(line[start:])
+        return statements
+
+    def finish(self):
+        """Return the statement left at the end of the script, if any."""
+        return self._pop()
+
+    def _pop(self):
+        statement = ''.join(self._parts)
+        has_code = self._has_code
+        self._parts = []
+        self._has_code = False
+        return statement if has_code else None
+
+    def _escape_string(self, line, pos):
+        # PostgreSQL only honours backslashes in E'...' strings.
+        return (pos > 0 and line[pos - 1] in 'eE' and
+                (pos == 1 or line[pos - 2] not in IDENTIFIER_CHARS))
+
+    def _line_comment(self, line, pos):
+        if line[pos] == '#':
+            return True
+        if not line.startswith('--', pos):
+            return False
+        if not self.mysql:
+            return True
+        # MySQL requires whitespace after the dashes.
+        return pos + 2 == len(line) or line[pos + 2].isspace()
+
+    def _skip_quoted(self, line, pos):
+        """Return the position after the end of a quote or comment.
+
+        Returns the length of the line if it does not end on this line.
+
+        """
+        closing = self._closing
+        if closing == '*/':
+            while True:
+                end = line.find('*/', pos)
+                nested = -1 if self.mysql else line.find('/*', pos)
+                if 0 <= nested < end or (end < 0 <= nested):
+                    self._depth += 1
+                    pos = nested + 2
+                elif end < 0:
+                    return len(line)
+                else:
+                    self._depth -= 1
+                    pos = end + 2
+                    if not self._depth:
+                        self._closing = None
+                        return pos
+        if len(closing) > 1:
+            # Dollar quote
+            end = line.find(closing, pos)
+            if end < 0:
+                return len(line)
+            self._closing = None
+            return end + len(closing)
+        while True:
+            end = line.find(closing, pos)
+            if self._backslash:
+                escape = line.find('\\', pos)
+                if 0 <= escape and (end < 0 or escape < end):
+                    pos = escape + 2
+                    continue
+            if end < 0:
+                return len(line)
+            if line.startswith(closing * 2, end):
+                pos = end + 2
+                continue
+            self._closing = None
+            return end + 1
+
+
+def split(lines, dialect='postgresql'):
+    """Yield the statements of an SQL script read line by line.
+
+    Statements are yielded as strings without their delimiter, comments
+    between statements are dropped. A PostgreSQL ``COPY ... FROM stdin``
+    statement is yielded as a `Copy` whose data has to be read before the
+    next statement is taken; data not read is skipped.
+
+    """
+    splitter = Splitter(dialect)
+    lines = iter(lines)
+    for line in lines:
+        for statement in splitter.feed(line):
+            if (not splitter.mysql and STDIN.search(statement) and
+                    COPY_FROM_STDIN.match(strip_comments(statement))):
+                copy = Copy(statement, lines)
+                yield copy
+                copy.exhaust()
+            else:
+                yield statement
+    statement = splitter.finish()
+    if statement is not None:
+        yield statement
+
+
+LEADING_COMMENTS = re.compile(r'(?:\s|--[^\n]*(?:\n|$)|/\*.*?\*/)*', re.S)
+
+
+def strip_comments(statement):
+    """Remove the comments in front of a statement."""
+    return statement[LEADING_COMMENTS.match(statement).end():]
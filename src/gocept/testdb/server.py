@@ -0,0 +1,268 @@
+import atexit
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+
+class Server:
+    """A throwaway database server run on this machine.
+
+    `start` initialises a data directory in RAM (``/dev/shm`` if it is
+    available), starts the server on a free port with durability turned off
+    and points the environment variables read by the database classes to
+    it, so database objects created afterwards use it. `stop` stops the
+    server, removes its data and restores the environment.
+
+    The server programs are looked up in ``bin_dir`` or else on the ``PATH``.
+
+    """
+
+    environ_prefix = NotImplemented
+    user = NotImplemented
+    # Seconds to wait for the server to accept connections:
+    start_timeout = 60
+
+    def __init__(self, bin_dir=None, base_dir=None):
+        self.bin_dir = bin_dir
+        if base_dir is None and os.access('/dev/shm', os.W_OK):
+            base_dir = '/dev/shm'
+        self.base_dir = base_dir
+        self.data_dir = None
+        self.port = None
+        self._saved_environ = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def environ(self):
+        """The environment variables pointing to the server."""
+        return {
+            self.environ_prefix + '_HOST': '127.0.0.1',
+            self.environ_prefix + '_PORT': str(self.port),
+            self.environ_prefix + '_USER': self.user,
+            self.environ_prefix + '_PASS': '',
+        }
+
+    def start(self):
+        self.data_dir = tempfile.mkdtemp(
+            prefix='gocept.testdb-', dir=self.base_dir)
+        try:
+            self.port = free_port()
+            self.initialise()
+            self.launch()
+        except BaseException:
+            try:
+                # The server may be running even if starting it failed.
+                self.shutdown()
+            except Exception:
+                pass
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+            self.data_dir = None
+            raise
+        self._saved_environ = {
+            name: os.environ.get(name) for name in self.environ}
+        os.environ.update(self.environ)
+
+    def stop(self):
+        if self.data_dir is None:
+            return
+        try:
+            self.shutdown()
+        finally:
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+            self.data_dir = None
+            for name, value in self._saved_environ.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            self._saved_environ = None
+
+    def initialise(self):
+        """Create the data directory of the server.
+
+        Depends on the choice of database engine.
+
+        """
+        raise NotImplementedError
+
+    def launch(self):
+        """Start the server and wait until it accepts connections.
+
+        Depends on the choice of database engine.
+
+        """
+        raise NotImplementedError
+
+    def shutdown(self):
+        """Stop the server without caring for its data.
+
+        Depends on the choice of database engine.
+
+        """
+        raise NotImplementedError
+
+    def command(self, name):
+        if self.bin_dir:
+            return os.path.join(self.bin_dir, name)
+        return name
+
+    def _run(self, args):
+        result = subprocess.run(
+            args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True)
+        if result.returncode:
+            raise RuntimeError(
+                'Could not run {}:\n{}'.format(' '.join(args), result.stdout))
+
+
+class PostgreSQLServer(Server):
+    """A throwaway PostgreSQL server.
+
+    Uses ``initdb`` and ``pg_ctl``. Note that PostgreSQL refuses to run as
+    the root user.
+
+    """
+
+    environ_prefix = 'POSTGRES'
+    user = 'postgres'
+    settings = {
+        'fsync': 'off',
+        'synchronous_commit': 'off',
+        'full_page_writes': 'off',
+        'wal_level': 'minimal',
+        'max_wal_senders': '0',
+        'max_wal_size': '1GB',
+        'checkpoint_timeout': '1h',
+    }
+
+    def initialise(self):
+        self._run([
+            self.command('initdb'), '-D', self._pgdata, '-U', self.user,
+            '-A', 'trust', '-E', 'UTF8', '--no-sync'])
+
+    @property
+    def _pgdata(self):
+        return os.path.join(self.data_dir, 'data')
+
+    def launch(self):
+        options = ['-p', str(self.port), '-h', '127.0.0.1',
+                   '-k', self.data_dir]
+        for name, value in sorted(self.settings.items()):
+            options.extend(['-c', f'{name}={value}'])
+        log = os.path.join(self.data_dir, 'server.log')
+        try:
+            self._run([
+                self.command('pg_ctl'), '-D', self._pgdata, '-l', log,
+                '-t', str(self.start_timeout), '-w', '-o', ' '.join(options),
+                'start'])
+        except RuntimeError as e:
+            if not os.path.exists(log):
+                raise
+            with open(log) as f:
+                raise RuntimeError(str(e) + f.read())
+
+    def shutdown(self):
+        self._run([
+            self.command('pg_ctl'), '-D', self._pgdata, '-m', 'immediate',
+            '-w', 'stop'])
+
+
+class MySQLServer(Server):
+    """A throwaway MySQL server.
+
+    Uses ``mysqld --initialize-insecure``, so the ``root`` user has no
+    password.
+
+    """
+
+    environ_prefix = 'MYSQL'
+    user = 'root'
+    settings = {
+        'innodb-flush-log-at-trx-commit': '0',
+        'innodb-doublewrite': '0',
+        'sync-binlog': '0',
+    }
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self._process = None
+
+    def _mysqld_args(self):
+        args = [self.command('mysqld'), '--no-defaults',
+                '--datadir=' + os.path.join(self.data_dir, 'data')]
+        if os.geteuid() == 0:
+            args.append('--user=root')
+        return args
+
+    def initialise(self):
+        self._run(self._mysqld_args() + ['--initialize-insecure'])
+
+    def launch(self):
+        args = self._mysqld_args() + [
+            '--port=%s' % self.port,
+            '--bind-address=127.0.0.1',
+            '--socket=' + os.path.join(self.data_dir, 'mysqld.sock'),
+            '--pid-file=' + os.path.join(self.data_dir, 'mysqld.pid'),
+            '--log-error=' + os.path.join(self.data_dir, 'error.log'),
+            '--skip-log-bin',
+        ]
+        args.extend(f'--{name}={value}'
+                    for name, value in sorted(self.settings.items()))
+        self._process = subprocess.Popen(args)
+        ping = [self.command('mysqladmin'), '--no-defaults',
+                '-h', '127.0.0.1', '-P', str(self.port), '--protocol=tcp',
+                '-u', self.user, 'ping']
+        deadline = time.monotonic() + self.start_timeout
+        while subprocess.call(ping, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL):
+            if self._process.poll() is not None or (
+                    time.monotonic() > deadline):
+                self.shutdown()
+                with open(os.path.join(self.data_dir, 'error.log')) as f:
+                    raise RuntimeError(
+                        'Could not start mysqld:\n' + f.read())
+            time.sleep(0.1)
+
+    def shutdown(self):
+        if self._process is None:
+            return
+        self._process.terminate()
+        try:
+            self._process.wait(30)
+        except subprocess.TimeoutExpired:  # pragma: no cover
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+
+
+def free_port():
+    """Return a TCP port on the local host that is not in use."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+_servers = {}
+
+
+def shared(server_class, **kw):
+    """Return the server of a class started for this process.
+
+    The server is started the first time and stopped when the process exits.
+
+    """
+    if server_class not in _servers:
+        server = server_class(**kw)
+        server.start()
+        atexit.register(server.stop)
+        _servers[server_class] = server
+    return _servers[server_class]
@@ -0,0 +1,65 @@
+import gocept.testdb.testing
+import json
+import os.path
+import unittest
+
+
+class SummaryTests(unittest.TestCase):
+    """Testing ..benchmark.summarize."""
+
+    def summarize(self, durations):
+        from gocept.testdb.benchmark import summarize
+        return summarize(durations)
+
+    def test_computes_percentiles_and_throughput(self):
+        summary = self.summarize([0.4, 0.1, 0.2, 0.3, 0.5])
+        self.assertEqual(5, summary['count'])
+        self.assertEqual(0.1, summary['min'])
+        self.assertEqual(0.5, summary['max'])
+        self.assertAlmostEqual(0.3, summary['mean'])
+        self.assertAlmostEqual(0.3, summary['p50'])
+        self.assertAlmostEqual(0.46, summary['p90'])
+        self.assertAlmostEqual(0.496, summary['p99'])
+        self.assertAlmostEqual(1.5, summary['total'])
+        self.assertAlmostEqual(5 / 1.5, summary['throughput'])
+
+    def test_total_only_computes_throughput(self):
+        from gocept.testdb.benchmark import summarize_total
+        self.assertEqual(dict(count=4, total=2.0, throughput=2.0),
+                         summarize_total(4, 2.0))
+
+    def test_handles_no_durations(self):
+        summary = self.summarize([])
+        self.assertEqual(0, summary['count'])
+        self.assertIsNone(summary['p50'])
+        self.assertIsNone(summary['throughput'])
+
+
+class BenchmarkTests(gocept.testdb.testing.TestCase):
+    """Testing ..benchmark.main."""
+
+    def test_writes_results_as_json(self):
+        from gocept.testdb.benchmark import main
+        output = os.path.join(self.sql_dir, 'results.json')
+        main(['-b', 'postgresql', '-t', '2', '-n', '2', '-o', output])
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual(2, report['iterations'])
+        self.assertEqual(
+            [('create', False), ('drop', False), ('drop_all', False),
+             ('create_template', True), ('create', True), ('drop', True),
+             ('drop_all', True)],
+            [(r['operation'], r['template']) for r in report['results']])
+        for result in report['results']:
+            self.assertEqual('postgresql', result['backend'])
+            self.assertEqual(2, result['tables'])
+            self.assertEqual(2, result['count'])
+            self.assertGreater(result['throughput'], 0)
+            if result['operation'] == 'drop_all':
+                self.assertNotIn('p50', result)
+            else:
+                self.assertGreater(result['p50'], 0)
+        db = gocept.testdb.PostgreSQL(prefix='testdb-benchmark')
+        self.assertEqual(
+            [], [name for name in db.list_db_names()
+                 if name.startswith('testdb-benchmark-PID%s' % os.getpid())])
@@ -1,10 +1,15 @@
+import contextlib
+import gocept.testdb
 import gocept.testdb.testing
+import io
 import os.path
 import shutil
 import stat
 import subprocess
 import sys
 import tempfile
+import unittest
+import unittest.mock
 
 
 class CommandlineTests(gocept.testdb.testing.TestCase):
@@ -66,7 +71,7 @@ gocept.testdb.cmdline.drop_all_entry_point()
     def call_script(self, *args):
         args = list(args)
         args[0] = os.path.join(self.bin_dir, args[0])
-        subprocess.call(args)
+        return subprocess.check_output(args).decode('utf-8')
 
     def test_drops_mysql_and_postgresql_databases(self):
         # The Database classes' ``drop_all`` functionality is available
@@ -107,3 +112,65 @@ gocept.testdb.cmdline.drop_all_entry_point()
             'drop-all', self.pid_prefix + 'foo', self.pid_prefix + 'bar')
         self.assertEqual(
             0, len(self.list_testdb_names(self.makePostgreSQL(create=False))))
+
+    def test_drops_template_replicas_on_postgresql(self):
+        self.makePostgreSQL(
+            'foo', db_template=self.pid_prefix + 'bar', template_replicas=2)
+        self.assertEqual(
+            4, len(self.list_testdb_names(self.makePostgreSQL(create=False))))
+        self.call_script(
+            'drop-all', self.pid_prefix + 'foo', self.pid_prefix + 'bar')
+        self.assertEqual(
+            0, len(self.list_testdb_names(self.makePostgreSQL(create=False))))
+
+    def test_drops_in_parallel_and_reports_summary(self):
+        for i in range(3):
+            self.makePostgreSQL('foo')
+        output = self.call_script(
+            'drop-all', '-j', '3', '-v', self.pid_prefix + 'foo')
+        self.assertEqual(
+            0, len(self.list_testdb_names(self.makePostgreSQL(create=False))))
+        self.assertEqual(3, output.count('Dropped gocept.testdb.tests-PID'))
+        self.assertIn('PostgreSQL: Dropped 3 database(s), 0 failed', output)
+
+    def test_min_age_keeps_younger_databases(self):
+        self.makePostgreSQL('foo')
+        output = self.call_script(
+            'drop-all', '--min-age', '3600', self.pid_prefix + 'foo')
+        self.assertEqual(
+            1, len(self.list_testdb_names(self.makePostgreSQL(create=False))))
+        self.assertIn('PostgreSQL: Dropped 0 database(s), 0 failed', output)
+
+
+class DropAllFunctionTests(unittest.TestCase):
+    """Testing ..cmdline.drop_all without database servers."""
+
+    def test_connection_failure_is_reported_and_other_server_handled(self):
+        import gocept.testdb.cmdline
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with unittest.mock.patch.object(
+                gocept.testdb.MySQL, 'drop_all',
+                side_effect=AssertionError('connection refused')), \
+                unittest.mock.patch.object(
+                    gocept.testdb.PostgreSQL, 'drop_all',
+                    return_value='summary'), \
+                contextlib.redirect_stdout(stdout), \
+                contextlib.redirect_stderr(stderr):
+            gocept.testdb.cmdline.drop_all(['foo'], min_age=3600)
+        self.assertEqual(
+            'MySQL: could not drop databases: connection refused\n',
+            stderr.getvalue())
+        self.assertEqual('PostgreSQL: summary\n', stdout.getvalue())
+
+    def test_mysql_template_is_only_dropped_if_asked_to(self):
+        import gocept.testdb.cmdline
+        with unittest.mock.patch.object(
+                gocept.testdb.MySQL, 'drop_all', autospec=True,
+                return_value=None) as drop_all, \
+                unittest.mock.patch.object(
+                    gocept.testdb.PostgreSQL, 'drop_all', return_value=None):
+            gocept.testdb.cmdline.drop_all(['foo'])
+            gocept.testdb.cmdline.drop_all(['foo'], mysql_templates=True)
+        self.assertEqual(
+            [None, 'foo'],
+            [c[0][0].db_template for c in drop_all.call_args_list])
@@ -0,0 +1,89 @@
+import gocept.testdb.testing
+import unittest.mock
+
+
+class DropQueueTests(gocept.testdb.testing.TestCase):
+    """Testing ..dropqueue.DropQueue."""
+
+    native = False
+
+    def setUp(self):
+        super().setUp()
+        import gocept.testdb.dropqueue
+        self.queue = gocept.testdb.dropqueue.DropQueue(batch_size=2)
+
+    def tearDown(self):
+        try:
+            self.queue.close()
+            self.makeOne().drop_all()
+        finally:
+            super().tearDown()
+
+    def makeOne(self, **kw):
+        import gocept.testdb
+        return gocept.testdb.PostgreSQL(
+            schema_path=self.schema, native=self.native,
+            drop_queue=self.queue, **kw)
+
+    def test_drop_renames_database_and_drops_it_in_background(self):
+        db = self.makeOne()
+        db.create()
+        db.drop()
+        self.assertFalse(db.exists)
+        self.queue.flush()
+        self.assertEqual(1, len(self.queue.dropped))
+        self.assertNotEqual(db.db_name, self.queue.dropped[0])
+        self.assertTrue(db._matches_db_naming_scheme(self.queue.dropped[0]))
+        self.assertEqual([], self.list_testdb_names(db))
+
+    def test_name_can_be_reused_right_after_drop(self):
+        db = self.makeOne(db_name=self.pid_prefix + 'fixed')
+        db.create()
+        db.drop()
+        db.create()
+        self.assertTrue(db.is_testing)
+        db.drop()
+        self.queue.flush()
+        self.assertEqual(2, len(self.queue.dropped))
+        self.assertEqual([], self.list_testdb_names(db))
+
+    def test_database_with_open_connection_is_dropped_under_its_name(self):
+        db = self.makeOne()
+        db.create()
+        engine = db.create_engine()
+        conn = engine.connect()
+        db.drop()
+        conn.close()
+        engine.dispose()
+        self.queue.flush()
+        self.assertEqual([db.db_name], self.queue.dropped)
+        self.assertFalse(db.exists)
+
+    def test_failure_to_drop_is_reported_as_warning(self):
+        db = self.makeOne(db_name=self.pid_prefix + 'fixed')
+        db.create()
+        with unittest.mock.patch.object(
+                db, 'drop_db', side_effect=AssertionError('broken')):
+            db.drop_timeout = 0
+            with self.assertWarnsRegex(
+                    RuntimeWarning, 'Could not drop database'):
+                self.queue.put(db)
+                self.queue.flush()
+        self.assertEqual(1, len(self.queue.failed))
+
+    def test_close_drops_databases_still_queued(self):
+        dbs = [self.makeOne() for i in range(3)]
+        for db in dbs:
+            db.create()
+        for db in dbs:
+            db.drop()
+        self.queue.close()
+        self.assertEqual(3, len(self.queue.dropped))
+        self.assertEqual([], self.list_testdb_names(dbs[0]))
+        with self.assertRaises(RuntimeError):
+            dbs[0].drop()
+
+
+class NativeDropQueueTests(DropQueueTests):
+
+    native = True
@@ -0,0 +1,113 @@
+import gocept.testdb.testing
+import io
+import unittest
+
+
+class SummaryTests(unittest.TestCase):
+    """Testing ..instrumentation.Summary."""
+
+    def test_aggregates_events_per_operation_and_path(self):
+        from gocept.testdb.instrumentation import Event
+        from gocept.testdb.instrumentation import Summary
+        summary = Summary()
+        summary(Event('create', 'a', 0.5, 'sql', 0))
+        summary(Event('create', 'b', 1.5, 'sql', 0))
+        summary(Event('create', 'c', 1.0, 'subprocess', 0))
+        summary(Event('drop', 'a', 0.1, 'sql', 2))
+        self.assertEqual(
+            dict(count=2, total=2.0, max=1.5, retries=0),
+            summary.stats[('create', 'sql')])
+        self.assertEqual(2, summary.stats[('drop', 'sql')]['retries'])
+
+    def test_report_lists_operations_by_total_time(self):
+        from gocept.testdb.instrumentation import Event
+        from gocept.testdb.instrumentation import Summary
+        summary = Summary()
+        summary(Event('drop', 'a', 0.1, 'sql', 1))
+        summary(Event('create', 'a', 0.5, 'sql', 0))
+        output = io.StringIO()
+        summary.report(output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual('gocept.testdb timings:', lines[1])
+        self.assertTrue(lines[3].startswith('create'))
+        self.assertTrue(lines[4].startswith('drop'))
+        self.assertEqual('1', lines[4].split()[-1])
+
+    def test_report_is_silent_without_events(self):
+        from gocept.testdb.instrumentation import Summary
+        output = io.StringIO()
+        Summary().report(output)
+        self.assertEqual('', output.getvalue())
+
+
+class InstrumentationTests(gocept.testdb.testing.TestCase):
+    """Testing events emitted by database operations."""
+
+    native = False
+
+    def setUp(self):
+        super().setUp()
+        import gocept.testdb.instrumentation
+        self.events = []
+        gocept.testdb.instrumentation.subscribe(self.events.append)
+
+    def tearDown(self):
+        import gocept.testdb.instrumentation
+        gocept.testdb.instrumentation.unsubscribe(self.events.append)
+        super().tearDown()
+
+    def makeOne(self, **kw):
+        import gocept.testdb
+        return gocept.testdb.PostgreSQL(
+            schema_path=self.schema, native=self.native, **kw)
+
+    def operations(self):
+        return [(event.operation, event.path) for event in self.events]
+
+    def test_create_and_drop_emit_events(self):
+        db = self.makeOne()
+        db.create()
+        db.drop()
+        path = 'sql' if self.native else 'subprocess'
+        operations = self.operations()
+        self.assertIn(('create_db', path), operations)
+        self.assertIn(('create_schema', path), operations)
+        self.assertIn(('drop_db', path), operations)
+        create = [e for e in self.events if e.operation == 'create'][0]
+        self.assertEqual(db.db_name, create.db_name)
+        drop = [e for e in self.events if e.operation == 'drop'][0]
+        self.assertEqual(db.db_name, drop.db_name)
+        self.assertEqual(0, drop.retries)
+        self.assertGreater(create.duration, 0)
+
+    def test_events_of_nested_operations_precede_outer_ones(self):
+        db = self.makeOne()
+        db.create()
+        self.addCleanup(db.drop)
+        self.assertEqual('create', self.events[-1].operation)
+        self.assertEqual(
+            'create_db', [event.operation for event in self.events][0])
+
+    def test_template_setup_is_reported_with_template_name(self):
+        db = self.makeOne(db_template=self.db_template)
+        db.create()
+        try:
+            setup = [
+                e for e in self.events if e.operation == 'setup_template']
+            self.assertEqual(1, len(setup))
+            self.assertEqual(self.db_template, setup[0].db_name)
+        finally:
+            # Cleanups would run after the prefix was reset.
+            db.drop_all(drop_template=True)
+
+    def test_no_events_after_unsubscribing(self):
+        import gocept.testdb.instrumentation
+        gocept.testdb.instrumentation.unsubscribe(self.events.append)
+        self.makeOne().list_db_names()
+        gocept.testdb.instrumentation.subscribe(self.events.append)
+        self.assertEqual([], self.events)
+
+
+class NativeInstrumentationTests(InstrumentationTests):
+
+    native = True
@@ -0,0 +1,68 @@
+import gocept.testdb.testing
+import sqlalchemy
+
+
+class IsolationTests:
+    """Testing ..isolation.TransactionIsolation."""
+
+    def setUp(self):
+        super().setUp()
+        import gocept.testdb.isolation
+        self.isolation = gocept.testdb.isolation.TransactionIsolation(
+            self.makeDatabase())
+        self.isolation.setUp()
+
+    def tearDown(self):
+        try:
+            if self.isolation.connection is not None:
+                self.isolation.testTearDown()
+            if self.isolation.engine is not None:
+                self.isolation.tearDown()
+        finally:
+            super().tearDown()
+
+    def count(self):
+        return self.execute(
+            self.isolation.database.dsn, 'SELECT COUNT(*) FROM foo',
+            fetch=True)[0][0]
+
+    def test_connection_sees_schema(self):
+        conn = self.isolation.testSetUp()
+        self.assertEqual(0, conn.execute(
+            sqlalchemy.text('SELECT COUNT(*) FROM foo')).scalar())
+
+    def test_changes_are_visible_during_test_and_rolled_back(self):
+        conn = self.isolation.testSetUp()
+        conn.execute(sqlalchemy.text('INSERT INTO foo VALUES (1)'))
+        self.assertEqual(1, conn.execute(
+            sqlalchemy.text('SELECT COUNT(*) FROM foo')).scalar())
+        self.isolation.testTearDown()
+        self.assertIsNone(self.isolation.connection)
+        self.assertEqual(0, self.count())
+
+    def test_database_is_shared_between_tests(self):
+        self.isolation.testSetUp()
+        self.isolation.testTearDown()
+        conn = self.isolation.testSetUp()
+        self.assertEqual(
+            self.isolation.database.db_name, conn.engine.url.database)
+
+    def test_database_is_dropped_on_tear_down(self):
+        db = self.isolation.database
+        self.isolation.tearDown()
+        self.assertFalse(db.exists)
+
+
+class PostgreSQLIsolationTests(IsolationTests,
+                               gocept.testdb.testing.TestCase):
+
+    def makeDatabase(self):
+        import gocept.testdb
+        return gocept.testdb.PostgreSQL(schema_path=self.schema)
+
+
+class MySQLIsolationTests(IsolationTests, gocept.testdb.testing.TestCase):
+
+    def makeDatabase(self):
+        import gocept.testdb
+        return gocept.testdb.MySQL(schema_path=self.schema)
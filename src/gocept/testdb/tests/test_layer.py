@@ -0,0 +1,71 @@
+import gocept.testdb.testing
+
+
+class DatabaseLayerTests(gocept.testdb.testing.TestCase):
+    """Testing ..layer.DatabaseLayer."""
+
+    def tearDown(self):
+        try:
+            self.makeDatabase(db_template=self.db_template).drop_all(
+                drop_template=True)
+        finally:
+            super().tearDown()
+
+    def makeDatabase(self, **kw):
+        import gocept.testdb
+        return gocept.testdb.PostgreSQL(schema_path=self.schema, **kw)
+
+    def makeOne(self, **kw):
+        import gocept.testdb.layer
+        return gocept.testdb.layer.DatabaseLayer(
+            self.makeDatabase(db_template=self.db_template), **kw)
+
+    def run_test(self, layer):
+        layer.testSetUp()
+        db = layer.db
+        self.assertTrue(db.is_testing)
+        layer.testTearDown()
+        return db
+
+    def test_has_name_module_and_bases_of_a_layer(self):
+        import gocept.testdb.layer
+        layer = self.makeOne(name='MyLayer')
+        self.assertEqual('MyLayer', layer.__name__)
+        self.assertEqual(__name__, layer.__module__)
+        self.assertEqual((), layer.__bases__)
+        other = gocept.testdb.layer.DatabaseLayer(
+            self.makeDatabase(), bases=[layer])
+        self.assertEqual((layer,), other.__bases__)
+
+    def test_clones_a_database_from_the_template_for_each_test(self):
+        layer = self.makeOne()
+        layer.setUp()
+        self.assertIn(self.db_template, layer.database.list_db_names())
+        first = self.run_test(layer)
+        second = self.run_test(layer)
+        self.assertNotEqual(first.db_name, second.db_name)
+        self.assertIsNone(layer.db)
+        self.assertTrue(first.exists)
+        self.assertTrue(second.exists)
+        layer.tearDown()
+        self.assertEqual(
+            [self.db_template], self.list_testdb_names(layer.database))
+
+    def test_drops_databases_in_batches(self):
+        layer = self.makeOne(drop_batch_size=2)
+        layer.setUp()
+        first = self.run_test(layer)
+        self.assertTrue(first.exists)
+        second = self.run_test(layer)
+        self.assertFalse(first.exists)
+        self.assertFalse(second.exists)
+        layer.tearDown()
+
+    def test_creates_databases_from_schema_without_template(self):
+        import gocept.testdb.layer
+        layer = gocept.testdb.layer.DatabaseLayer(self.makeDatabase())
+        layer.setUp()
+        db = self.run_test(layer)
+        self.assertEqual(['foo', 'tmp_functest'], self.table_names(db.dsn))
+        layer.tearDown()
+        self.assertEqual([], self.list_testdb_names(layer.database))
@@ -1,5 +1,10 @@
+import asyncio
 import gocept.testdb.testing
 import gocept.testing.assertion
+import io
+import os
+import subprocess
+import unittest.mock
 
 
 class MySQLTests(gocept.testdb.testing.TestCase,
@@ -7,13 +12,17 @@ class MySQLTests(gocept.testdb.testing.TestCase,
                  gocept.testing.assertion.Exceptions):
     """Testing ..mysql.MySQL"""
 
+    native = False
+
     def tearDown(self):
         self.makeOne(create_db=False).drop_all()
         super().tearDown()
 
-    def makeOne(self, db_name=None, create_db=True):
+    def makeOne(self, db_name=None, create_db=True, **kw):
         import gocept.testdb
-        db = gocept.testdb.MySQL(schema_path=self.schema, db_name=db_name)
+        db = gocept.testdb.MySQL(
+            schema_path=self.schema, db_name=db_name, native=self.native,
+            **kw)
         if create_db:
             db.create()
         return db
@@ -47,6 +56,13 @@ class MySQLTests(gocept.testdb.testing.TestCase,
         with self.assertNothingRaised():
             self.execute(db.dsn, 'SELECT * from tmp_functest')
 
+    def test_marker_records_schema_creation_time_and_process(self):
+        db = self.makeOne()
+        marker = db.get_marker()
+        self.assertEqual(db._schema_digest(), marker['schema_digest'])
+        self.assertEqual(os.getpid(), marker['pid'])
+        self.assertIsNotNone(marker['created'])
+
     def test_schema_gets_loaded(self):
         db = self.makeOne()
         with self.assertNothingRaised():
@@ -73,3 +89,168 @@ class MySQLTests(gocept.testdb.testing.TestCase,
         db.drop_db(self.pid_prefix + 'foo')
         db.drop_db(self.pid_prefix + 'bar')
         self.assertEqual(0, len(self.list_testdb_names(db)))
+
+    def test_drop_all_drops_in_parallel_and_reports(self):
+        db = self.makeOne()
+        self.makeOne()
+        summary = db.drop_all(concurrency=2)
+        self.assertEqual([], self.list_testdb_names(db))
+        self.assertEqual(2, len(summary.dropped))
+        self.assertEqual([], summary.failed)
+
+    def test_drop_all_keeps_databases_younger_than_min_age(self):
+        db = self.makeOne()
+        self.assertEqual([], db.drop_all(min_age=3600).dropped)
+        self.assertEqual([db.db_name], db.drop_all(min_age=0).dropped)
+
+    def test_snapshot_can_be_restored_into_new_database(self):
+        self.write(self.schema, """\
+CREATE TABLE foo (id int PRIMARY KEY) ENGINE=InnoDB;
+CREATE TABLE bar (foo_id int, FOREIGN KEY (foo_id) REFERENCES foo (id))
+    ENGINE=InnoDB;
+""")
+        db = self.makeOne()
+        self.execute(db.dsn, 'INSERT INTO foo VALUES (42)')
+        self.execute(db.dsn, 'INSERT INTO bar VALUES (42)')
+        db.snapshot('seeded')
+        self.execute(db.dsn, 'DELETE FROM bar')
+        restored = db.restore('seeded')
+        self.assertEqual(
+            [(42,)], self.execute(restored.dsn, 'SELECT * FROM bar', True))
+        self.assertEqual([], self.execute(db.dsn, 'SELECT * FROM bar', True))
+        # Foreign keys are copied, too:
+        with self.assertRaises(Exception):
+            self.execute(restored.dsn, 'INSERT INTO bar VALUES (1)')
+        db.drop_all(drop_template=True)
+        self.assertEqual([], self.list_testdb_names(db))
+
+    def test_template_is_created_once_and_copied(self):
+        self.write(self.schema, """\
+CREATE TABLE foo (id int PRIMARY KEY) ENGINE=InnoDB;
+INSERT INTO foo VALUES (42);
+""")
+        db = self.makeOne(db_template=self.db_template)
+        self.addCleanup(db.drop_all, drop_template=True)
+        self.assertIn(self.db_template, db.list_db_names())
+        created = db.get_marker(self.db_template)['created']
+        db2 = self.makeOne(db_template=self.db_template)
+        self.assertEqual(
+            created, db2.get_marker(self.db_template)['created'])
+        self.assertEqual(
+            [(42,)], self.execute(db2.dsn, 'SELECT * FROM foo', True))
+        self.assertTrue(db2.is_testing)
+
+    def test_template_is_rebuilt_when_schema_changes(self):
+        db = self.makeOne(db_template=self.db_template)
+        self.addCleanup(db.drop_all, drop_template=True)
+        self.write(self.schema, 'CREATE TABLE bar (id int);')
+        db = self.makeOne(db_template=self.db_template)
+        with self.assertNothingRaised():
+            self.execute(db.dsn, 'SELECT * FROM bar')
+        self.assertEqual(db._schema_digest(),
+                         db._get_db_digest(self.db_template))
+
+    def test_drop_all_drops_template_only_if_asked(self):
+        db = self.makeOne(db_template=self.db_template)
+        db.drop_all()
+        self.assertIn(self.db_template, db.list_db_names())
+        db.drop_all(drop_template=True)
+        self.assertNotIn(self.db_template, db.list_db_names())
+
+    def test_fast_mode_loads_schema_in_one_transaction_unchecked(self):
+        self.write(self.schema, """\
+CREATE TABLE bar (foo_id int, FOREIGN KEY (foo_id) REFERENCES foo (id))
+    ENGINE=InnoDB;
+CREATE TABLE foo (id int PRIMARY KEY) ENGINE=InnoDB;
+INSERT INTO bar VALUES (42);
+INSERT INTO foo VALUES (42);
+""")
+        db = self.makeOne(fast=True)
+        self.assertEqual(
+            [(42,)], self.execute(db.dsn, 'SELECT * FROM bar', True))
+        self.assertTrue(db.is_testing)
+
+    def test_async_api_creates_and_drops_databases_concurrently(self):
+        dbs = [self.makeOne(create_db=False) for i in range(3)]
+
+        async def create_and_drop():
+            await asyncio.gather(*[db.acreate() for db in dbs])
+            names = await dbs[0].alist_db_names()
+            await asyncio.gather(*[db.adrop() for db in dbs])
+            return names
+
+        names = asyncio.run(create_and_drop())
+        for db in dbs:
+            self.assertIn(db.db_name, names)
+            self.assertNotIn(db.db_name, db.list_db_names())
+
+    def test_async_drop_all_drops_all_databases(self):
+        db = self.makeOne()
+        self.makeOne()
+        asyncio.run(db.adrop_all())
+        self.assertEqual([], self.list_testdb_names(db))
+
+
+class NativeMySQLTests(MySQLTests):
+    """Testing ..mysql.MySQL talking SQL instead of calling tools."""
+
+    native = True
+
+    def test_uses_maintenance_connection(self):
+        db = self.makeOne()
+        self.assertTrue(db._maintenance_engines)
+        self.assertIn(db.db_name, db.list_db_names())
+        db.drop()
+        self.assertNotIn(db.db_name, db.list_db_names())
+
+    def test_schema_with_several_statements_gets_loaded(self):
+        self.write(self.schema, """\
+CREATE TABLE foo (dummy int);
+CREATE TABLE bar (dummy int);
+INSERT INTO bar VALUES (1);
+""")
+        db = self.makeOne()
+        self.assertEqual(
+            [(1,)], self.execute(db.dsn, 'SELECT * FROM bar', fetch=True))
+
+    def test_broken_schema_raises_SystemExit(self):
+        self.write(self.schema, 'CREATE TABLE foo (dummy int);\nfoobar;')
+        db = self.makeOne(create_db=False)
+        with self.assertRaises(SystemExit):
+            db.create()
+
+
+class Stream(io.BytesIO):
+
+    def close(self):
+        self.closed_value = self.getvalue()
+
+
+class ClientProgramTests(gocept.testdb.testing.TestCase):
+    """Testing ..mysql.MySQL calling the client programs, without a server.
+    """
+
+    def test_each_file_ends_its_statements_and_delimiter(self):
+        import gocept.testdb
+        first = os.path.join(self.sql_dir, 'a.sql')
+        second = os.path.join(self.sql_dir, 'b.sql')
+        self.write(first, 'DELIMITER $$\nCREATE PROCEDURE p() BEGIN SELECT 1;'
+                   ' END$$\nCREATE TABLE a (x int)')
+        self.write(second, 'CREATE TABLE b (x int);\n')
+        db = gocept.testdb.MySQL(schema_path=[first, second])
+        stream = Stream()
+        db._write_schema(stream, 'MARKER;\n')
+        self.assertEqual(
+            b'DELIMITER $$\nCREATE PROCEDURE p() BEGIN SELECT 1; END$$\n'
+            b'CREATE TABLE a (x int)\n$$\nDELIMITER ;\n'
+            b'CREATE TABLE b (x int);\n\n'
+            b'MARKER;\n', stream.closed_value)
+
+    def test_timeout_of_drop_raises_AssertionError(self):
+        import gocept.testdb
+        db = gocept.testdb.MySQL()
+        with unittest.mock.patch(
+                'subprocess.call',
+                side_effect=subprocess.TimeoutExpired('mysqladmin', 10)):
+            with self.assertRaises(AssertionError):
+                db.drop_db(db.db_name)
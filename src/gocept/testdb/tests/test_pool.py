@@ -0,0 +1,88 @@
+import gocept.testdb.testing
+import os
+import time
+
+
+class PoolTests(gocept.testdb.testing.TestCase):
+    """Testing ..pool.Pool."""
+
+    def setUp(self):
+        super().setUp()
+        self.pools = []
+
+    def tearDown(self):
+        try:
+            for pool in self.pools:
+                pool.close()
+            self.makeDatabase().drop_all(drop_template=True)
+        finally:
+            super().tearDown()
+
+    def makeDatabase(self):
+        import gocept.testdb
+        return gocept.testdb.PostgreSQL(
+            schema_path=self.schema, db_template=self.db_template)
+
+    def makeOne(self, size=2):
+        import gocept.testdb.pool
+        pool = gocept.testdb.pool.Pool(self.makeDatabase(), size=size)
+        self.pools.append(pool)
+        pool.start()
+        return pool
+
+    def wait_until_filled(self, pool):
+        for i in range(100):
+            if len(pool._ready) == pool.size:
+                break
+            time.sleep(0.05)
+
+    def test_requires_template(self):
+        import gocept.testdb
+        import gocept.testdb.pool
+        with self.assertRaises(ValueError):
+            gocept.testdb.pool.Pool(gocept.testdb.PostgreSQL())
+
+    def test_acquire_returns_database_cloned_from_template(self):
+        pool = self.makeOne()
+        db = pool.acquire()
+        self.assertNotEqual(self.db_template, db.db_name)
+        self.assertEqual(['foo', 'tmp_functest'], self.table_names(db.dsn))
+        self.assertTrue(db.is_testing)
+
+    def test_counts_hits_misses_and_wait_time(self):
+        pool = self.makeOne(size=1)
+        pool.acquire()
+        self.assertEqual(1, pool.misses)
+        self.assertGreater(pool.wait_time, 0)
+        self.wait_until_filled(pool)
+        pool.acquire()
+        self.assertEqual(
+            dict(hits=1, misses=1, wait_time=pool.wait_time), pool.stats)
+
+    def test_release_drops_database(self):
+        pool = self.makeOne()
+        db = pool.acquire()
+        pool.release(db)
+        for i in range(100):
+            if db.db_name not in db.list_db_names():
+                break
+            time.sleep(0.05)
+        self.assertNotIn(db.db_name, db.list_db_names())
+
+    def test_close_drops_pooled_databases(self):
+        pool = self.makeOne()
+        self.wait_until_filled(pool)
+        pool.close()
+        self.assertEqual(
+            [self.db_template], self.list_testdb_names(pool.database))
+
+    def test_schema_change_invalidates_pool(self):
+        pool = self.makeOne()
+        self.wait_until_filled(pool)
+        stale = [db.db_name for db in pool._ready]
+        self.write(self.schema, 'CREATE TABLE bar (dummy int);')
+        mtime = os.path.getmtime(self.schema) + 1
+        os.utime(self.schema, (mtime, mtime))
+        db = pool.acquire()
+        self.assertNotIn(db.db_name, stale)
+        self.assertEqual(['bar', 'tmp_functest'], self.table_names(db.dsn))
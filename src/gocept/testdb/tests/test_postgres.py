@@ -1,9 +1,15 @@
+import asyncio
 import gocept.testdb
 import gocept.testdb.testing
 import gocept.testing.assertion
 import os
+import sqlalchemy.engine.url
 import sqlalchemy.exc
+import subprocess
+import sys
+import threading
 import time
+import unittest.mock
 
 
 class PostgreSQLTests(gocept.testdb.testing.TestCase,
@@ -13,6 +19,7 @@ class PostgreSQLTests(gocept.testdb.testing.TestCase,
     """Testing ..postgres.PostgreSQL."""
 
     db_template = 'gocept.testdb.tests-template-%s' % os.getpid()
+    native = False
 
     def tearDown(self):
         try:
@@ -26,6 +33,7 @@ class PostgreSQLTests(gocept.testdb.testing.TestCase,
 
     def makeOne(self, create_db=True, db_template=None, **kw):
         import gocept.testdb
+        kw.setdefault('native', self.native)
         db = gocept.testdb.PostgreSQL(
             db_template=db_template, **kw)
         if create_db:
@@ -70,6 +78,69 @@ class PostgreSQLTests(gocept.testdb.testing.TestCase,
         with self.assertNothingRaised():
             self.execute(db.dsn, 'SELECT * from tmp_functest')
 
+    def test_marker_records_schema_creation_time_and_process(self):
+        db = self.makeOne(schema_path=self.schema)
+        marker = db.get_marker()
+        self.assertEqual(db._schema_digest(), marker['schema_digest'])
+        self.assertEqual(db._schema_mtime(), marker['schema_mtime'])
+        self.assertEqual(os.getpid(), marker['pid'])
+        self.assertIsNotNone(marker['created'])
+
+    def test_template_with_unchanged_schema_is_reused(self):
+        # regression test: reading the marker failed on SQLAlchemy < 1.4
+        self.makeOne(schema_path=self.schema, db_template=self.db_template)
+        db = self.makeOne(schema_path=self.schema,
+                          db_template=self.db_template, create_db=False)
+        self.assertEqual(db._schema_digest(),
+                         db.get_marker(self.db_template)['schema_digest'])
+        with unittest.mock.patch.object(
+                db, 'create_db_from_schema') as create_db_from_schema:
+            db.create()
+        create_db_from_schema.assert_not_called()
+        self.assertTrue(db.is_testing)
+
+    def test_schema_and_marker_are_loaded_in_one_transaction(self):
+        broken_schema = self.schema + '-broken'
+        self.write(broken_schema, 'CREATE TABLE foo (dummy int);\nfoobar;\n')
+        db = self.makeOne(schema_path=broken_schema, create_db=False)
+        with self.assertRaises(SystemExit):
+            db.create()
+        self.assertEqual([], self.table_names(db.dsn))
+        self.assertIsNone(db.get_marker())
+
+    def test_fast_mode_makes_tables_unlogged_and_commits_asynchronous(self):
+        self.write(self.schema, """\
+CREATE TABLE a (id int PRIMARY KEY);
+CREATE TABLE b (a_id int REFERENCES a);
+CREATE TABLE c (id int PRIMARY KEY, d_id int);
+CREATE TABLE d (id int PRIMARY KEY, c_id int REFERENCES c);
+ALTER TABLE c ADD FOREIGN KEY (d_id) REFERENCES d;
+INSERT INTO a VALUES (1);
+""")
+        db = self.makeOne(
+            schema_path=self.schema, db_template=self.db_template, fast=True)
+        self.assertEqual(
+            [('a', 'u'), ('b', 'u'), ('c', 'p'), ('d', 'p'),
+             ('tmp_functest', 'u')],
+            self.execute(db.dsn, "SELECT relname, relpersistence"
+                         " FROM pg_class WHERE relkind = 'r'"
+                         " AND relnamespace = 'public'::regnamespace"
+                         " ORDER BY relname", fetch=True))
+        self.assertEqual(
+            [(1,)], self.execute(db.dsn, 'SELECT * FROM a', fetch=True))
+        self.assertEqual([('off',)], self.execute(
+            db.dsn, 'SHOW synchronous_commit', fetch=True))
+        self.assertTrue(db.is_testing)
+
+    def test_fast_mode_creates_database_with_one_client_call(self):
+        db = self.makeOne(create_db=False, fast=True)
+        with unittest.mock.patch(
+                'subprocess.call', wraps=subprocess.call) as call:
+            db.create_db(db.db_name)
+        self.assertEqual(0 if self.native else 1, call.call_count)
+        self.assertEqual([('off',)], self.execute(
+            db.dsn, 'SHOW synchronous_commit', fetch=True))
+
     def test_conveniences_properties_are_set(self):
         db = self.makeOne()
         self.assertTrue(db.exists)
@@ -80,6 +151,61 @@ class PostgreSQLTests(gocept.testdb.testing.TestCase,
         with self.assertNothingRaised():
             self.execute(db.dsn, 'SELECT * from foo')
 
+    def test_schema_with_copy_from_stdin_gets_loaded(self):
+        dump = self.schema + '-dump'
+        self.write(dump, """\
+--
+-- PostgreSQL database dump
+--
+SET client_encoding = 'UTF8';
+CREATE TABLE public.foo (id integer, value text);
+CREATE FUNCTION public.semicolon() RETURNS text
+    LANGUAGE sql AS $$SELECT ';'::text$$;
+
+--
+-- Data for Name: foo; Type: TABLE DATA
+--
+
+COPY public.foo (id, value) FROM stdin;
+1\tone; two
+2\t\\N
+\\.
+
+SELECT pg_catalog.set_config('search_path', '', false);
+""")
+        db = self.makeOne(schema_path=dump)
+        self.assertEqual(
+            [(1, 'one; two'), (2, None)],
+            self.execute(
+                db.dsn, 'SELECT * FROM foo ORDER BY id', fetch=True))
+
+    def write_including_schema(self):
+        os.mkdir(os.path.join(self.sql_dir, 'parts'))
+        schema = os.path.join(self.sql_dir, 'parts', 'main.sql')
+        self.write(schema, 'CREATE TABLE foo (dummy int);\n\\ir bar.sql\n')
+        self.write(os.path.join(self.sql_dir, 'parts', 'bar.sql'),
+                   'CREATE TABLE bar (dummy int);\n')
+        return schema
+
+    def test_schema_may_include_files_relative_to_it(self):
+        db = self.makeOne(schema_path=self.write_including_schema())
+        self.assertEqual(
+            ['bar', 'foo', 'tmp_functest'], sorted(self.table_names(db.dsn)))
+
+    def test_schema_loading_reports_progress(self):
+        self.write(self.schema, ''.join(
+            'CREATE TABLE foo%s (dummy int);\n' % i for i in range(100)))
+        progress = []
+        db = self.makeOne(
+            schema_path=self.schema, schema_progress=lambda *args:
+            progress.append(args), create_db=False)
+        db.schema_batch_size = 500
+        db.create()
+        size = os.path.getsize(self.schema)
+        self.assertEqual((size, size), progress[-1])
+        self.assertLess(progress[0][0], size)
+        self.assertEqual(101, len(self.table_names(db.dsn)))
+
     def test_name_of_database_can_be_specified(self):
         db = self.makeOne(db_name='mytestdb', create_db=False)
         self.assertEndsWith('/mytestdb', db.dsn)
@@ -92,6 +218,88 @@ class PostgreSQLTests(gocept.testdb.testing.TestCase,
         self.assertEllipsis(
             '... database ... does not exist...', str(err.exception))
 
+    def test_drop_drops_database_with_open_connection_at_once(self):
+        db = self.makeOne()
+        conn = self.connect(db)
+        start = time.monotonic()
+        db.drop()
+        # The server would wait for 5 seconds for the connection to close.
+        self.assertLess(time.monotonic() - start, 3)
+        self.assertNotIn(db.db_name, db.list_db_names())
+        conn.invalidate()
+
+    def test_drop_retries_with_growing_delays_until_timeout(self):
+        db = self.makeOne()
+        db.drop_timeout = 0.5
+        with unittest.mock.patch.object(
+                db, 'drop_db', side_effect=AssertionError), \
+                unittest.mock.patch('time.sleep') as sleep:
+            with self.assertRaises(RuntimeError):
+                db.drop()
+        delays = [call[0][0] for call in sleep.call_args_list]
+        self.assertEqual([0.05, 0.1, 0.2], delays[:3])
+        self.assertLessEqual(max(delays), 1)
+        db.drop()
+        self.assertFalse(db.exists)
+
+    def test_drop_gives_up_if_database_remains_without_error(self):
+        db = self.makeOne()
+        db.drop_timeout = 0.5
+        with unittest.mock.patch.object(db, 'drop_db') as drop_db, \
+                unittest.mock.patch('time.sleep'):
+            with self.assertRaises(RuntimeError):
+                db.drop()
+        self.assertLess(drop_db.call_count, 10)
+        db.drop()
+
+    def test_async_drop_retries_and_reports_like_drop(self):
+        import gocept.testdb.instrumentation
+        db = self.makeOne()
+        db.drop_timeout = 0.5
+        events = []
+        gocept.testdb.instrumentation.subscribe(events.append)
+        self.addCleanup(
+            gocept.testdb.instrumentation.unsubscribe, events.append)
+        delays = []
+
+        async def sleep(delay):
+            delays.append(delay)
+
+        with unittest.mock.patch.object(
+                db, 'drop_db', side_effect=AssertionError), \
+                unittest.mock.patch('asyncio.sleep', new=sleep):
+            with self.assertRaises(RuntimeError):
+                asyncio.run(db.adrop())
+        self.assertEqual([0.05, 0.1, 0.2], delays[:3])
+        self.assertEqual(
+            [len(delays)],
+            [event.retries for event in events if event.operation == 'drop'])
+        asyncio.run(db.adrop())
+        self.assertFalse(db.exists)
+
+    def test_engine_is_reused_until_database_is_dropped(self):
+        db = self.makeOne()
+        engine = db.get_engine()
+        self.assertTrue(db.is_testing)
+        self.assertIs(engine, db.get_engine())
+        self.assertIs(engine, db._copy(db.db_name).get_engine())
+        db.drop()
+        self.assertIsNot(engine, db.get_engine())
+
+    def test_dispose_discards_engines(self):
+        db = self.makeOne()
+        engine = db.get_engine()
+        db.dispose()
+        self.assertIsNot(engine, db.get_engine())
+
+    def test_create_engine_passes_keyword_arguments(self):
+        import sqlalchemy.pool
+        db = self.makeOne()
+        engine = db.create_engine(poolclass=sqlalchemy.pool.StaticPool)
+        self.addCleanup(engine.dispose)
+        self.assertIsInstance(engine.pool, sqlalchemy.pool.StaticPool)
+        self.assertEqual(db.db_name, engine.url.database)
+
     def test_encoding_is_used(self):
         # An optional encoding parameter can be specified in the constructor.
         # It is used when creating the database.
@@ -141,8 +349,8 @@ class PostgreSQLTests(gocept.testdb.testing.TestCase,
                          self.table_names(db3.dsn))
 
         # The template db (and with it, the test db) ist also created anew if
-        # the schema file is newer than the existing template db:
-        time.sleep(1)  # XXX hack; either fake db mtime or see #12431
+        # the content of the schema file differs from the one the existing
+        # template db was created from:
         self.write(self.schema, 'CREATE TABLE bar (dummy int);')
         db4 = self.makeOne(
             schema_path=self.schema, db_template=self.db_template,
@@ -167,6 +375,404 @@ class PostgreSQLTests(gocept.testdb.testing.TestCase,
             "'gocept.testdb.tests-PID...-templatetest'.", str(err.exception))
         self.assertNotIn(self.db_template, db_broken.list_db_names())
 
+    def test_template_is_kept_if_only_schema_mtime_changes(self):
+        db = self.makeOne(
+            schema_path=self.schema, db_template=self.db_template)
+        self.execute(db.get_dsn(self.db_template), 'CREATE TABLE bar (x int)')
+        mtime = os.path.getmtime(self.schema) + 10
+        os.utime(self.schema, (mtime, mtime))
+        db2 = self.makeOne(
+            schema_path=self.schema, db_template=self.db_template)
+        self.assertEqual(['bar', 'foo', 'tmp_functest'],
+                         sorted(self.table_names(db2.dsn)))
+
+    def test_template_records_schema_digest(self):
+        db = self.makeOne(
+            schema_path=self.schema, db_template=self.db_template)
+        self.assertEqual(64, len(db._schema_digest()))
+        self.assertEqual(
+            db._schema_digest(), db._get_db_digest(self.db_template))
+
+    def test_schema_digest_covers_included_files(self):
+        os.mkdir(os.path.join(self.sql_dir, 'parts'))
+        self.write(self.schema, '\\ir parts/a.sql\n')
+        self.write(os.path.join(self.sql_dir, 'parts', 'a.sql'),
+                   '\\ir b.sql\n\\ir a.sql\n')
+        part = os.path.join(self.sql_dir, 'parts', 'b.sql')
+        self.write(part, 'CREATE TABLE foo (dummy int);')
+        db = self.makeOne(schema_path=self.schema, create_db=False)
+        digest = db._schema_digest()
+        self.write(part, 'CREATE TABLE foo (dummy text);')
+        self.assertNotEqual(digest, db._schema_digest())
+
+    def test_schema_is_only_read_again_for_digest_if_it_changed(self):
+        self.write(self.schema, 'CREATE TABLE foo (dummy int);')
+        db = self.makeOne(schema_path=self.schema, create_db=False)
+        digest = db._schema_digest()
+        with unittest.mock.patch(
+                'builtins.open', side_effect=AssertionError('read')):
+            self.assertEqual(digest, db._schema_digest())
+        self.write(self.schema, 'CREATE TABLE bar (dummy int);')
+        os.utime(self.schema, ns=(0, 0))
+        self.assertNotEqual(digest, db._schema_digest())
+
+    def test_template_without_digest_is_rebuilt(self):
+        db = self.makeOne(
+            schema_path=self.schema, db_template=self.db_template)
+        dsn = db.get_dsn(self.db_template)
+        self.execute(dsn, 'ALTER TABLE tmp_functest DROP COLUMN schema_digest')
+        self.assertIsNone(db._get_db_digest(self.db_template))
+        self.makeOne(schema_path=self.schema, db_template=self.db_template)
+        self.assertEqual(
+            db._schema_digest(), db._get_db_digest(self.db_template))
+
+    def make_migrations(self, *names):
+        path = os.path.join(self.sql_dir, 'migrations')
+        os.makedirs(path, exist_ok=True)
+        for name in names:
+            self.write(os.path.join(path, name + '.sql'),
+                       'CREATE TABLE %s (x int);' % name)
+        return path
+
+    def test_schema_file_may_end_without_semicolon(self):
+        path = self.make_migrations('a1')
+        self.write(os.path.join(path, 'a0.sql'), 'CREATE TABLE a0 (x int)')
+        db = self.makeOne(schema_path=path)
+        self.assertEqual(
+            ['a0', 'a1', 'tmp_functest'], sorted(self.table_names(db.dsn)))
+
+    def test_schema_files_of_directory_are_loaded_by_name(self):
+        path = self.make_migrations('a2', 'a1')
+        self.write(os.path.join(path, 'a3.sql'),
+                   'INSERT INTO a1 SELECT COUNT(*) FROM a2;')
+        self.write(os.path.join(path, 'README'), 'not SQL')
+        db = self.makeOne(schema_path=path)
+        self.assertEqual(['a1', 'a2', 'tmp_functest'],
+                         sorted(self.table_names(db.dsn)))
+        self.assertEqual([['a1.sql', db._schema_file_digests()[0][1]],
+                          ['a2.sql', db._schema_file_digests()[1][1]],
+                          ['a3.sql', db._schema_file_digests()[2][1]]],
+                         db._get_db_file_digests(db.db_name))
+
+    def test_schema_may_be_a_list_of_files(self):
+        other = os.path.join(self.sql_dir, 'other.sql')
+        self.write(other, 'CREATE TABLE bar (x int)')
+        db = self.makeOne(schema_path=[self.schema, other])
+        self.assertEqual(['bar', 'foo', 'tmp_functest'],
+                         sorted(self.table_names(db.dsn)))
+
+    def test_template_is_updated_with_added_schema_files(self):
+        path = self.make_migrations('a1')
+        self.makeOne(schema_path=path, db_template=self.db_template)
+        self.execute(self.makeOne(create_db=False).get_dsn(self.db_template),
+                     'INSERT INTO a1 VALUES (42)')
+        self.make_migrations('a2', 'a3')
+        db = self.makeOne(schema_path=path, db_template=self.db_template)
+        self.assertEqual(['a1', 'a2', 'a3', 'tmp_functest'],
+                         sorted(self.table_names(db.dsn)))
+        # The template was not built from scratch:
+        self.assertEqual(
+            [(42,)], self.execute(db.dsn, 'SELECT * FROM a1', fetch=True))
+        self.assertEqual(
+            db._schema_digest(), db._get_db_digest(self.db_template))
+        self.assertEqual(3, len(db._get_db_file_digests(db.db_name)))
+        # No copy of the template is left besides the two test databases:
+        self.assertEqual(2, len([name for name in db.list_db_names()
+                                 if db._matches_db_naming_scheme(name)]))
+
+    def test_template_is_rebuilt_if_a_schema_file_changed(self):
+        path = self.make_migrations('a1', 'a2')
+        self.makeOne(schema_path=path, db_template=self.db_template)
+        self.execute(self.makeOne(create_db=False).get_dsn(self.db_template),
+                     'INSERT INTO a1 VALUES (42)')
+        self.write(os.path.join(path, 'a1.sql'), 'CREATE TABLE a1 (y int);')
+        self.make_migrations('a3')
+        db = self.makeOne(schema_path=path, db_template=self.db_template)
+        self.assertEqual(
+            [], self.execute(db.dsn, 'SELECT * FROM a1', fetch=True))
+        self.assertEqual(['a1', 'a2', 'a3', 'tmp_functest'],
+                         sorted(self.table_names(db.dsn)))
+
+    def test_template_is_rebuilt_if_added_schema_file_fails(self):
+        path = self.make_migrations('a1')
+        self.makeOne(schema_path=path, db_template=self.db_template)
+        self.write(os.path.join(path, 'a2.sql'), 'ALTER TABLE a1 ADD y int;')
+        # Applying a2 to the template fails, building from scratch works:
+        self.execute(self.makeOne(create_db=False).get_dsn(self.db_template),
+                     'ALTER TABLE a1 ADD y int')
+        db = self.makeOne(schema_path=path, db_template=self.db_template)
+        self.assertEqual(
+            db._schema_digest(), db._get_db_digest(self.db_template))
+
+    def test_template_setup_waits_for_lock_held_by_other_process(self):
+        db = self.makeOne(
+            schema_path=self.schema, db_template=self.db_template,
+            create_db=False)
+        other = self.makeOne(
+            schema_path=self.schema, db_template=self.db_template,
+            create_db=False)
+        with db._template_lock():
+            thread = threading.Thread(target=other.setup_template)
+            thread.start()
+            thread.join(0.5)
+            self.assertTrue(thread.is_alive())
+            self.assertNotIn(self.db_template, db.list_db_names())
+        thread.join()
+        self.assertIn(self.db_template, db.list_db_names())
+
+    def test_concurrent_processes_build_template_once(self):
+        script = """\
+import sys
+sys.path = {path!r}
+import gocept.testdb
+gocept.testdb.PostgreSQL(
+    schema_path={schema!r}, db_template={template!r},
+    prefix={prefix!r}, native={native!r}).create()
+""".format(path=sys.path, schema=self.schema, template=self.db_template,
+           prefix=self.pid_prefix + 'worker', native=self.native)
+        workers = [subprocess.Popen([sys.executable, '-c', script])
+                   for i in range(4)]
+        self.assertEqual([0] * 4, [worker.wait() for worker in workers])
+        dsn = self.makeOne(create_db=False).get_dsn(self.db_template)
+        self.assertEqual(
+            [(1,)],
+            self.execute(dsn, 'SELECT COUNT(*) FROM tmp_functest', fetch=True))
+        self.makeOne(create_db=False, prefix=self.pid_prefix + 'worker',
+                     db_template=self.db_template).drop_all()
+
+    def test_template_replicas_are_cloned_from_template(self):
+        db = self.makeOne(
+            schema_path=self.schema, db_template=self.db_template,
+            template_replicas=2)
+        replicas = [self.db_template + '-replica-0',
+                    self.db_template + '-replica-1']
+        for name in replicas:
+            self.assertIn(name, db.list_db_names())
+            self.assertEqual(['foo', 'tmp_functest'],
+                             self.table_names(db.get_dsn(name)))
+        self.assertIn(db.template_source, replicas)
+        self.assertEqual(['foo', 'tmp_functest'], self.table_names(db.dsn))
+
+    def test_template_source_depends_on_xdist_worker(self):
+        db = self.makeOne(
+            db_template=self.db_template, template_replicas=2,
+            create_db=False)
+        orig = os.environ.get('PYTEST_XDIST_WORKER')
+        os.environ['PYTEST_XDIST_WORKER'] = 'gw3'
+        try:
+            self.assertEqual(
+                self.db_template + '-replica-1', db.template_source)
+        finally:
+            if orig is None:
+                del os.environ['PYTEST_XDIST_WORKER']
+            else:  # pragma: no cover
+                os.environ['PYTEST_XDIST_WORKER'] = orig
+        db.template_replicas = 0
+        self.assertEqual(self.db_template, db.template_source)
+
+    def test_template_replicas_are_rebuilt_with_template(self):
+        db = self.makeOne(
+            schema_path=self.schema, db_template=self.db_template,
+            template_replicas=3)
+        self.write(self.schema, 'CREATE TABLE bar (dummy int);')
+        self.makeOne(
+            schema_path=self.schema, db_template=self.db_template,
+            template_replicas=2)
+        self.assertNotIn(
+            self.db_template + '-replica-2', db.list_db_names())
+        for i in range(2):
+            self.assertEqual(
+                ['bar', 'tmp_functest'],
+                self.table_names(
+                    db.get_dsn(self.db_template + '-replica-%s' % i)))
+
+    def test_template_without_replicas_is_not_listed_when_reused(self):
+        db = self.makeOne(
+            db_template=self.db_template, create_db=False)
+        with unittest.mock.patch.object(
+                db, 'list_db_names', side_effect=AssertionError):
+            db._template_set_up(rebuilt=False)
+
+    def test_replica_clean_up_keeps_snapshots_and_test_databases(self):
+        db = self.makeOne(
+            schema_path=self.schema, db_template=self.db_template)
+        db.snapshot('seeded')
+        other = self.makeOne(db_name=self.db_template + '-123456789012')
+        self.write(self.schema, 'CREATE TABLE bar (dummy int);')
+        self.makeOne(
+            schema_path=self.schema, db_template=self.db_template,
+            template_replicas=1)
+        names = db.list_db_names()
+        self.assertIn(db._snapshot_name('seeded'), names)
+        self.assertIn(other.db_name, names)
+        self.assertIn(self.db_template + '-replica-0', names)
+        other.drop()
+
+    def test_drop_all_drops_template_replicas(self):
+        db = self.makeOne(
+            db_template=self.db_template, template_replicas=2)
+        db.drop_all()
+        self.assertEqual(3, len([
+            name for name in db.list_db_names()
+            if name.startswith(self.db_template)]))
+        db.drop_all(drop_template=True)
+        self.assertEqual([], [
+            name for name in db.list_db_names()
+            if name.startswith(self.db_template)])
+
+    def test_async_api_creates_and_drops_databases_concurrently(self):
+        dbs = [self.makeOne(schema_path=self.schema, create_db=False)
+               for i in range(3)]
+
+        async def create_and_drop():
+            await asyncio.gather(*[db.acreate() for db in dbs])
+            names = await dbs[0].alist_db_names()
+            await asyncio.gather(*[db.adrop() for db in dbs])
+            return names
+
+        names = asyncio.run(create_and_drop())
+        for db in dbs:
+            self.assertIn(db.db_name, names)
+            self.assertNotIn(db.db_name, db.list_db_names())
+
+    def test_async_drop_all_drops_all_databases(self):
+        db = self.makeOne(db_template=self.db_template)
+        other = self.makeOne()
+        progress = []
+        summary = asyncio.run(db.adrop_all(
+            progress=lambda *args: progress.append(args)))
+        self.assertEqual([self.db_template], self.list_testdb_names(db))
+        self.assertEqual(
+            sorted([db.db_name, other.db_name]), sorted(summary.dropped))
+        self.assertIn((other.db_name, True), progress)
+        asyncio.run(db.adrop_all(drop_template=True))
+        self.assertEqual([], self.list_testdb_names(db))
+
+    def test_async_drop_all_keeps_going_and_reports_failures(self):
+        db = self.makeOne()
+        other = self.makeOne()
+        self.assertEqual(
+            [], asyncio.run(db.adrop_all(min_age=3600)).dropped)
+        drop_db = gocept.testdb.PostgreSQL.drop_db
+
+        def drop_all_but_first(self, name):
+            if name == db.db_name:
+                raise AssertionError('in use')
+            drop_db(self, name)
+
+        with unittest.mock.patch.object(
+                gocept.testdb.PostgreSQL, 'drop_db', drop_all_but_first):
+            summary = asyncio.run(db.adrop_all(concurrency=1))
+        self.assertEqual([other.db_name], summary.dropped)
+        self.assertEqual([db.db_name], summary.failed)
+        self.assertEqual([db.db_name], self.list_testdb_names(db))
+
+    def test_drop_all_drops_in_parallel_and_reports(self):
+        db = self.makeOne()
+        for i in range(3):
+            self.makeOne()
+        progress = []
+        summary = db.drop_all(
+            concurrency=4, progress=lambda *args: progress.append(args))
+        self.assertEqual([], self.list_testdb_names(db))
+        self.assertEqual(4, len(summary.dropped))
+        self.assertEqual([], summary.failed)
+        self.assertIn(db.db_name, summary.dropped)
+        self.assertIn((db.db_name, True), progress)
+        self.assertEllipsis(
+            'Dropped 4 database(s), 0 failed, in ... seconds.', str(summary))
+
+    def test_drop_all_keeps_databases_younger_than_min_age(self):
+        db = self.makeOne()
+        summary = db.drop_all(min_age=3600)
+        self.assertEqual([], summary.dropped)
+        self.assertEqual([db.db_name], self.list_testdb_names(db))
+        summary = db.drop_all(min_age=0)
+        self.assertEqual([db.db_name], summary.dropped)
+
+    def test_drop_all_keeps_databases_of_unknown_age(self):
+        db = self.makeOne()
+        self.assertIn(db.db_name, db._db_ages())
+        with unittest.mock.patch.object(
+                db, '_execute', side_effect=AssertionError('denied')):
+            self.assertEqual({}, db._db_ages())
+        with unittest.mock.patch.object(db, '_db_ages', return_value={}):
+            self.assertEqual([], db.drop_all(min_age=0).dropped)
+        self.assertEqual([db.db_name], self.list_testdb_names(db))
+
+    def test_drop_all_does_not_need_ages_if_nothing_matches(self):
+        db = self.makeOne(create_db=False)
+        with unittest.mock.patch.object(
+                db, '_db_ages', side_effect=AssertionError('down')):
+            self.assertEqual([], db.drop_all(min_age=0).dropped)
+
+    def test_snapshot_can_be_restored_into_new_database(self):
+        db = self.makeOne(schema_path=self.schema)
+        self.execute(db.dsn, 'INSERT INTO foo VALUES (42)')
+        db.snapshot('seeded')
+        self.execute(db.dsn, 'DELETE FROM foo')
+        restored = db.restore('seeded')
+        self.assertNotEqual(db.db_name, restored.db_name)
+        self.assertEqual(
+            [(42,)], self.execute(restored.dsn, 'SELECT * FROM foo', True))
+        self.assertEqual([], self.execute(db.dsn, 'SELECT * FROM foo', True))
+
+    def test_snapshot_replaces_existing_snapshot(self):
+        db = self.makeOne(schema_path=self.schema)
+        db.snapshot('seeded')
+        self.execute(db.dsn, 'INSERT INTO foo VALUES (42)')
+        db.snapshot('seeded')
+        restored = db.restore('seeded')
+        self.assertEqual(
+            [(42,)], self.execute(restored.dsn, 'SELECT * FROM foo', True))
+
+    def test_restoring_unknown_snapshot_raises_RuntimeError(self):
+        db = self.makeOne(create_db=False)
+        with self.assertRaises(RuntimeError):
+            db.restore('unknown')
+
+    def test_snapshots_are_dropped_like_templates(self):
+        db = self.makeOne()
+        snapshot = db.prefix + '-snapshot-seeded'
+        db.snapshot('seeded')
+        db.drop_snapshot('seeded')
+        self.assertNotIn(snapshot, db.list_db_names())
+        db.snapshot('seeded')
+        db.drop_all()
+        self.assertIn(snapshot, db.list_db_names())
+        db.drop_all(drop_template=True)
+        self.assertNotIn(snapshot, db.list_db_names())
+
+    def test_dropping_databases_lists_them_at_most_once(self):
+        import gocept.testdb.base
+        dbs = [self.makeOne() for i in range(3)]
+        gocept.testdb.base.catalogue.invalidate(dbs[0]._catalogue_key())
+        list_db_names = unittest.mock.Mock(wraps=dbs[0].list_db_names)
+        with unittest.mock.patch.object(
+                gocept.testdb.PostgreSQL, 'list_db_names', list_db_names):
+            for db in dbs:
+                db.drop()
+        self.assertEqual(0 if self.native else 1, list_db_names.call_count)
+        self.assertEqual([], self.list_testdb_names(dbs[0]))
+
+    def test_drop_notices_database_dropped_by_other_process(self):
+        db = self.makeOne()
+        self.assertTrue(db._db_exists(db.db_name))
+        db.dispose()
+        db._execute('DROP DATABASE "%s"' % db.db_name)
+        db.drop()
+        self.assertFalse(db._db_exists(db.db_name))
+
+    def test_template_is_checked_without_cached_listing(self):
+        db = self.makeOne(db_template=self.db_template, create_db=False)
+        self.assertFalse(db._db_exists(self.db_template))
+        db._execute('CREATE DATABASE "%s"' % self.db_template)
+        # The template has no digest, so it gets rebuilt instead of trying to
+        # create it once more.
+        self.assertTrue(db.create_template())
+        self.assertEqual(
+            db._schema_digest(), db._get_db_digest(self.db_template))
+
     def test_drop_all_drops_all_databases(self):
         # There's a method to drop all test databases that may have been left
         # on the server by previous test runs by removing all (but only those)
@@ -191,3 +797,136 @@ class PostgreSQLTests(gocept.testdb.testing.TestCase,
         db.drop_all(drop_template=True)
         self.assertNotIn(db.db_template, db.list_db_names())
         self.assertEqual([], self.list_testdb_names(db))
+
+
+class NativePostgreSQLTests(PostgreSQLTests):
+    """Testing ..postgres.PostgreSQL talking SQL instead of calling tools."""
+
+    native = True
+
+    def test_uses_maintenance_connection(self):
+        db = self.makeOne(create_db=False)
+        db.create()
+        self.assertTrue(db._maintenance_engines)
+        self.assertIn(db.db_name, db.list_db_names())
+        db.drop()
+        self.assertNotIn(db.db_name, db.list_db_names())
+
+    def test_schema_may_include_files_relative_to_it(self):
+        # Including files requires psql.
+        db = self.makeOne(
+            schema_path=self.write_including_schema(),
+            db_template=self.db_template, create_db=False)
+        with self.assertRaises(SystemExit) as err:
+            db.create()
+        self.assertIn('\\ir bar.sql', str(err.exception.__context__))
+        self.assertNotIn(self.db_template, db.list_db_names())
+        self.assertNotIn(db.db_name, db.list_db_names())
+
+    def test_schema_that_is_not_utf_8_raises_SystemExit(self):
+        with open(self.schema, 'wb') as f:
+            f.write(b"CREATE TABLE foo (name text DEFAULT '\xe4');\n")
+        db = self.makeOne(schema_path=self.schema,
+                          db_template=self.db_template, create_db=False)
+        with self.assertRaises(SystemExit):
+            db.create()
+        self.assertNotIn(self.db_template, db.list_db_names())
+
+    def test_broken_schema_raises_SystemExit(self):
+        broken_schema = self.schema + '-broken'
+        self.write(broken_schema, 'foobar')
+        db = self.makeOne(schema_path=broken_schema, create_db=False)
+        with self.assertRaises(SystemExit):
+            db.create()
+
+
+class ShardingTests(gocept.testdb.testing.TestCase):
+    """Testing ..postgres.PostgreSQL placing databases on several servers.
+
+    Both servers are the local one under different host names.
+
+    """
+
+    hosts = 'localhost,127.0.0.1'
+
+    def setUp(self):
+        super().setUp()
+        patcher = unittest.mock.patch.dict(
+            os.environ, {'POSTGRES_HOST': self.hosts})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def makeOne(self, **kw):
+        import gocept.testdb
+        return gocept.testdb.PostgreSQL(schema_path=self.schema, **kw)
+
+    def test_hosts_and_ports_are_listed_separated_by_commas(self):
+        os.environ['POSTGRES_PORT'] = '5432'
+        self.assertEqual([('localhost', '5432'), ('127.0.0.1', '5432')],
+                         self.makeOne().servers)
+        os.environ.update(POSTGRES_HOST='db', POSTGRES_PORT='5432, 5433')
+        self.assertEqual([('db', '5432'), ('db', '5433')],
+                         self.makeOne().servers)
+        os.environ['POSTGRES_HOST'] = 'a,b,c'
+        with self.assertRaises(ValueError):
+            self.makeOne()
+
+    def test_databases_are_placed_on_servers_by_name(self):
+        db = self.makeOne()
+        copies = [db._copy(db._random_name(), place=True) for i in range(20)]
+        self.assertEqual({'localhost', '127.0.0.1'},
+                         {copy.db_host for copy in copies})
+        for copy in copies:
+            self.assertEqual(copy.db_host,
+                             sqlalchemy.engine.url.make_url(copy.dsn).host)
+            self.assertEqual(copy.db_host,
+                             self.makeOne(db_name=copy.db_name).db_host)
+            self.assertEqual(copy.db_host, copy._copy('other').db_host)
+
+    def test_restored_database_is_placed_on_server_of_snapshot(self):
+        db = self.makeOne()
+        with unittest.mock.patch.object(db, '_copy_db'):
+            restored = [db.restore('seeded') for i in range(10)]
+        for copy in restored:
+            self.assertEqual(db.db_host, copy.db_host)
+            self.assertEqual(copy.db_host,
+                             self.makeOne(db_name=copy.db_name).db_host)
+
+    def test_template_is_set_up_on_each_server(self):
+        db = self.makeOne(db_template=self.db_template)
+        with unittest.mock.patch.object(
+                gocept.testdb.PostgreSQL, 'create_template',
+                autospec=True, return_value=False) as create_template:
+            db.setup_template()
+        self.assertEqual(
+            ['localhost', '127.0.0.1'],
+            [c[0][0].db_host for c in create_template.call_args_list])
+
+    def test_clones_on_all_servers_are_dropped_by_name(self):
+        db = self.makeOne(db_template=self.db_template)
+        try:
+            db.setup_template()
+            copies = [db._copy(db._random_name(), place=True)
+                      for i in range(6)]
+            for copy in copies:
+                copy.create_from_template()
+                self.assertTrue(copy.is_testing)
+            summary = db.drop_dbs([copy.db_name for copy in copies])
+            self.assertEqual(6, len(summary.dropped))
+            self.assertEqual([db.db_template], self.list_testdb_names(db))
+        finally:
+            db.drop_db(db.db_template)
+            db.dispose()
+
+    def test_drop_all_drops_databases_on_each_server(self):
+        db = self.makeOne()
+        with unittest.mock.patch.object(
+                gocept.testdb.PostgreSQL, '_names_to_drop', autospec=True,
+                side_effect=lambda self, *args: [self.db_host]), \
+                unittest.mock.patch.object(
+                    gocept.testdb.PostgreSQL, 'drop_db',
+                    autospec=True) as drop_db:
+            summary = db.drop_all()
+        self.assertEqual(['localhost', '127.0.0.1'], summary.dropped)
+        self.assertEqual(['localhost', '127.0.0.1'],
+                         [c[0][0].db_host for c in drop_db.call_args_list])
@@ -0,0 +1,117 @@
+import gocept.testdb.testing
+import os
+import subprocess
+import sys
+
+
+class PytestPluginTests(gocept.testdb.testing.TestCase):
+    """Testing ..pytest_plugin by running pytest on sample tests."""
+
+    def tearDown(self):
+        try:
+            self.makeDatabase().drop_all(drop_template=True)
+        finally:
+            super().tearDown()
+
+    def makeDatabase(self):
+        import gocept.testdb
+        return gocept.testdb.PostgreSQL(db_template=self.db_template)
+
+    def run_pytest(self, tests, test_dir='', **options):
+        options.setdefault('testdb_schema', 'sample.sql')
+        options.setdefault('testdb_prefix', self.makeDatabase().prefix)
+        self.write(
+            os.path.join(self.sql_dir, 'pytest.ini'),
+            '[pytest]\n' + ''.join(
+                f'{key} = {value}\n' for key, value in options.items()))
+        test_dir = os.path.join(self.sql_dir, test_dir)
+        os.makedirs(test_dir, exist_ok=True)
+        self.write(os.path.join(test_dir, 'test_sample.py'), tests)
+        env = dict(os.environ, PYTEST_DISABLE_PLUGIN_AUTOLOAD='1')
+        return subprocess.run(
+            [sys.executable, '-m', 'pytest',
+             '-p', 'gocept.testdb.pytest_plugin', '-p', 'no:cacheprovider',
+             '-q', 'test_sample.py'],
+            cwd=test_dir, env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True)
+
+    def assertPassed(self, count, result):
+        self.assertEqual(0, result.returncode, result.stdout)
+        self.assertIn(f'{count} passed', result.stdout)
+
+    ISOLATED_TESTS = """\
+import sqlalchemy
+
+
+def insert_and_count(connection):
+    connection.execute(sqlalchemy.text('INSERT INTO foo VALUES (1)'))
+    return connection.execute(
+        sqlalchemy.text('SELECT count(*) FROM foo')).scalar()
+
+
+def test_one(testdb_postgres_connection):
+    assert 1 == insert_and_count(testdb_postgres_connection)
+
+
+def test_two(testdb_postgres_connection):
+    assert 1 == insert_and_count(testdb_postgres_connection)
+"""
+
+    def test_databases_are_cloned_from_template_and_dropped_at_end(self):
+        result = self.run_pytest("""\
+names = set()
+
+
+def test_one(testdb_postgres):
+    assert testdb_postgres.is_testing
+    names.add(testdb_postgres.db_name)
+
+
+def test_two(testdb_postgres):
+    assert testdb_postgres.db_name not in names
+    assert testdb_postgres.db_name in testdb_postgres.list_db_names()
+""", testdb_template=self.db_template)
+        self.assertPassed(2, result)
+        self.assertEqual(
+            [self.db_template], self.list_testdb_names(self.makeDatabase()))
+
+    def test_databases_can_be_created_from_schema_without_template(self):
+        result = self.run_pytest(self.ISOLATED_TESTS)
+        self.assertPassed(2, result)
+        self.assertEqual([], self.list_testdb_names(self.makeDatabase()))
+
+    def test_schema_is_relative_to_configuration_file(self):
+        result = self.run_pytest(self.ISOLATED_TESTS, test_dir='tests')
+        self.assertPassed(2, result)
+
+    def test_transaction_isolation_shares_one_database(self):
+        result = self.run_pytest(
+            self.ISOLATED_TESTS + """
+
+names = set()
+
+
+def test_three(testdb_postgres):
+    names.add(testdb_postgres.db_name)
+
+
+def test_four(testdb_postgres):
+    assert testdb_postgres.db_name in names
+""", testdb_isolation='transaction', testdb_template=self.db_template)
+        self.assertPassed(4, result)
+        self.assertEqual(
+            [self.db_template], self.list_testdb_names(self.makeDatabase()))
+
+    def test_pool_isolation_hands_out_pooled_databases(self):
+        result = self.run_pytest(
+            self.ISOLATED_TESTS, testdb_isolation='pool',
+            testdb_pool_size='1', testdb_template=self.db_template)
+        self.assertPassed(2, result)
+        self.assertEqual(
+            [self.db_template], self.list_testdb_names(self.makeDatabase()))
+
+    def test_unknown_isolation_is_a_usage_error(self):
+        result = self.run_pytest(
+            self.ISOLATED_TESTS, testdb_isolation='magic')
+        self.assertIn('testdb_isolation must be one of', result.stdout)
+        self.assertNotEqual(0, result.returncode)
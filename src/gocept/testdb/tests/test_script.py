@@ -0,0 +1,116 @@
+import unittest
+
+
+class SplitTests(unittest.TestCase):
+    """Testing ..script.split."""
+
+    def split(self, text, dialect='postgresql'):
+        from gocept.testdb.script import Copy
+        from gocept.testdb.script import split
+        result = []
+        for statement in split(text.splitlines(True), dialect):
+            if isinstance(statement, Copy):
+                result.append((statement.statement.strip(), statement.read()))
+            else:
+                result.append(statement.strip())
+        return result
+
+    def test_splits_at_semicolons(self):
+        self.assertEqual(
+            ['SELECT 1', 'SELECT 2', 'SELECT\n3'],
+            self.split('SELECT 1; SELECT 2;\nSELECT\n3;\n'))
+
+    def test_yields_last_statement_without_delimiter(self):
+        self.assertEqual(['SELECT 1', 'SELECT 2'],
+                         self.split('SELECT 1;\nSELECT 2\n'))
+
+    def test_ignores_delimiters_in_strings_and_identifiers(self):
+        self.assertEqual(
+            ["INSERT INTO \"a;b\" VALUES ('it''s; fine')", 'SELECT 2'],
+            self.split("INSERT INTO \"a;b\" VALUES ('it''s; fine');"
+                       "SELECT 2;"))
+
+    def test_ignores_delimiters_in_strings_spanning_lines(self):
+        self.assertEqual(["SELECT 'a;\nb;'", 'SELECT 2'],
+                         self.split("SELECT 'a;\nb;';\nSELECT 2;"))
+
+    def test_honours_backslash_escapes_in_postgresql_e_strings(self):
+        self.assertEqual(
+            ["SELECT E'it\\'s;'", "SELECT 'C:\\'", 'SELECT 3'],
+            self.split("SELECT E'it\\'s;'; SELECT 'C:\\'; SELECT 3;"))
+
+    def test_ignores_delimiters_in_dollar_quotes(self):
+        self.assertEqual(
+            ['CREATE FUNCTION f() RETURNS int AS $body$\n'
+             'SELECT 1; $$ $body$ LANGUAGE sql',
+             'SELECT $$;$$'],
+            self.split('CREATE FUNCTION f() RETURNS int AS $body$\n'
+                       'SELECT 1; $$ $body$ LANGUAGE sql;\n'
+                       'SELECT $$;$$;'))
+
+    def test_parameters_are_no_dollar_quotes(self):
+        self.assertEqual(['SELECT $1', 'SELECT 2'],
+                         self.split('SELECT $1; SELECT 2;'))
+
+    def test_ignores_delimiters_in_comments(self):
+        self.assertEqual(
+            ['-- a; b\nSELECT 1', '/* a; /* b; */ c; */ SELECT 2'],
+            self.split('-- a; b\nSELECT 1;\n'
+                       '/* a; /* b; */ c; */ SELECT 2;'))
+
+    def test_drops_comments_between_statements(self):
+        self.assertEqual(['-- a\nSELECT 1'],
+                         self.split('-- a\nSELECT 1;\n-- b\n/* c */\n'))
+
+    def test_skips_psql_meta_commands_guarding_dumps(self):
+        self.assertEqual(['SELECT 1'], self.split(
+            '\\restrict abc\nSELECT 1;\n\\unrestrict abc\n'))
+
+    def test_raises_on_other_psql_meta_commands(self):
+        for command in ['\\connect foo', '\\i foo.sql', '\\ir foo.sql']:
+            with self.assertRaises(ValueError) as err:
+                self.split('SELECT 1;\n%s\n' % command)
+            self.assertIn(command, str(err.exception))
+
+    def test_yields_copy_from_stdin_with_data(self):
+        self.assertEqual(
+            ['SELECT 1',
+             ('--\nCOPY public.foo (a, b) FROM stdin', '1\tx;\n2\t\\N\n'),
+             'SELECT 2'],
+            self.split('SELECT 1;\n--\n'
+                       'COPY public.foo (a, b) FROM stdin;\n'
+                       '1\tx;\n2\t\\N\n\\.\nSELECT 2;\n'))
+
+    def test_copy_data_not_read_is_skipped(self):
+        from gocept.testdb.script import split
+        statements = list(split(
+            'COPY foo FROM stdin;\n1\n2\n\\.\nSELECT 2;\n'.splitlines(True)))
+        self.assertEqual('SELECT 2', statements[1].strip())
+
+    def test_copy_data_can_be_read_in_chunks(self):
+        from gocept.testdb.script import split
+        copy = next(split(
+            'COPY foo FROM stdin;\n123\n456\n\\.\n'.splitlines(True)))
+        self.assertEqual(['12', '3\n', '45', '6\n', ''],
+                         [copy.read(2) for i in range(5)])
+
+    def test_mysql_understands_backticks_escapes_and_hash_comments(self):
+        self.assertEqual(
+            ["INSERT INTO `a;b` VALUES ('it\\'s;')", '# c;\nSELECT 1--1'],
+            self.split("INSERT INTO `a;b` VALUES ('it\\'s;');\n"
+                       "# c;\nSELECT 1--1;\n", 'mysql'))
+
+    def test_mysql_executable_comments_are_statements(self):
+        self.assertEqual(['/*!40101 SET NAMES utf8 */'],
+                         self.split('/*!40101 SET NAMES utf8 */;\n', 'mysql'))
+
+    def test_mysql_delimiter_command_changes_delimiter(self):
+        self.assertEqual(
+            ['CREATE TRIGGER t BEFORE INSERT ON x FOR EACH ROW\n'
+             'BEGIN SET @a = 1; SET @b = 2; END',
+             'SELECT 2'],
+            self.split('DELIMITER ;;\n'
+                       'CREATE TRIGGER t BEFORE INSERT ON x FOR EACH ROW\n'
+                       'BEGIN SET @a = 1; SET @b = 2; END ;;\n'
+                       'DELIMITER ;\n'
+                       'SELECT 2;\n', 'mysql'))
@@ -0,0 +1,81 @@
+import gocept.testdb.testing
+import os
+import shutil
+import subprocess
+import unittest
+import unittest.mock
+
+
+@unittest.skipIf(shutil.which('initdb') is None or os.geteuid() == 0,
+                 'initdb is not available or refuses to run as root.')
+class PostgreSQLServerTests(gocept.testdb.testing.TestCase):
+    """Testing ..server.PostgreSQLServer."""
+
+    def makeOne(self, **kw):
+        import gocept.testdb.server
+        return gocept.testdb.server.PostgreSQLServer(**kw)
+
+    def test_databases_are_created_on_server_while_it_runs(self):
+        import gocept.testdb
+        port = os.environ.get('POSTGRES_PORT')
+        with self.makeOne() as server:
+            self.assertEqual(str(server.port), os.environ['POSTGRES_PORT'])
+            self.assertTrue(os.path.isdir(server.data_dir))
+            db = gocept.testdb.PostgreSQL(schema_path=self.schema)
+            self.assertIn(':%s/' % server.port, db.dsn)
+            db.create()
+            self.assertTrue(db.is_testing)
+            self.assertEqual(
+                [('off',)], self.execute(db.dsn, 'SHOW fsync', fetch=True))
+            data_dir = server.data_dir
+            db.dispose()
+        self.assertFalse(os.path.exists(data_dir))
+        self.assertEqual(port, os.environ.get('POSTGRES_PORT'))
+
+    def test_data_directory_is_in_given_base_directory(self):
+        with self.makeOne(base_dir=self.sql_dir) as server:
+            self.assertEqual(self.sql_dir, os.path.dirname(server.data_dir))
+
+
+@unittest.skipIf(shutil.which('mysqld') is None, 'mysqld is not available.')
+class MySQLServerTests(gocept.testdb.testing.TestCase):
+    """Testing ..server.MySQLServer."""
+
+    def test_databases_are_created_on_server_while_it_runs(self):
+        import gocept.testdb
+        import gocept.testdb.server
+        with gocept.testdb.server.MySQLServer() as server:
+            self.assertEqual(str(server.port), os.environ['MYSQL_PORT'])
+            db = gocept.testdb.MySQL(schema_path=self.schema, native=True)
+            db.create()
+            self.assertTrue(db.is_testing)
+            data_dir = server.data_dir
+            db.dispose()
+        self.assertFalse(os.path.exists(data_dir))
+
+
+class MySQLServerStartTests(gocept.testdb.testing.TestCase):
+    """Testing ..server.MySQLServer failing to start, without mysqld."""
+
+    def test_server_is_stopped_if_mysqladmin_is_missing(self):
+        import gocept.testdb.server
+        mysqld = os.path.join(self.sql_dir, 'mysqld')
+        with open(mysqld, 'w') as f:
+            f.write('#!/bin/sh\n'
+                    'case "$*" in *--initialize-insecure*) exit 0;; esac\n'
+                    'exec sleep 60\n')
+        os.chmod(mysqld, 0o755)
+        processes = []
+        Popen = subprocess.Popen
+
+        def popen(*args, **kw):
+            processes.append(Popen(*args, **kw))
+            self.addCleanup(processes[-1].kill)
+            return processes[-1]
+
+        server = gocept.testdb.server.MySQLServer(bin_dir=self.sql_dir)
+        with unittest.mock.patch('subprocess.Popen', side_effect=popen):
+            with self.assertRaises(OSError):
+                server.start()
+        self.assertIsNotNone(processes[-1].poll())
+        self.assertIsNone(server.data_dir)